@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+################################################################################
+# benchmarks.py                                                                #
+#                                                                              #
+# Part of UMass Amherst's Wind Energy Engineering Toolbox of Mini-Codes        #
+#                   (or Mini-Codes for short)                                  #
+#                                                                              #
+# Python code by Alec Koumjian  -   akoumjian@gmail.com                        #
+#                                                                              #
+# This code adapted from the original Visual Basic code at                     #
+# http://www.ceere.org/rerl/projects/software/mini-code-overview.html          #
+#                                                                              #
+# These tools can be used in conjunction with the textbook                     #
+# "Wind Energy Explained" by J.F. Manwell, J.G. McGowan and A.L. Rogers        #
+# http://www.ceere.org/rerl/rerl_windenergytext.html                           #
+#                                                                              #
+################################################################################
+#   Copyright 2009 Alec Koumjian                                               #
+#                                                                              #
+#   This program is free software: you can redistribute it and/or modify       #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#    This program is distributed in the hope that it will be useful,           #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#    GNU General Public License for more details.                              #
+#                                                                              #
+#    You should have received a copy of the GNU General Public License         #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+################################################################################
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+## Run from the source tree without installing
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## Modules that must only be loaded when a function needs them
+HEAVY_MODULES = ['matplotlib', 'scikits.timeseries', 'scipy', 'wx']
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.time()
+import windenergytk.%s
+elapsed = time.time() - start
+heavy = [name for name in %r if name in sys.modules]
+sys.stdout.write('%%f %%s' %% (elapsed, ','.join(heavy)))
+"""
+
+
+def time_import(module, repeat=5):
+    """Import a windenergytk module in fresh interpreters.
+
+    INPUT
+    module: (str) module name inside windenergytk, e.g. 'analysis'
+    repeat: (int) number of fresh interpreters to time
+
+    OUTPUT
+    best_time: (float) fastest import time in seconds
+    heavy: (list) heavy modules that were loaded by the import
+    """
+    times = []
+    for run in range(repeat):
+        output = subprocess.Popen([sys.executable, '-c',
+                                   IMPORT_SCRIPT % (module, HEAVY_MODULES)],
+                                  cwd=PACKAGE_DIR,
+                                  stdout=subprocess.PIPE).communicate()[0]
+        elapsed, heavy = output.decode().split(' ')
+        times.append(float(elapsed))
+    return min(times), [name for name in heavy.split(',') if name]
+
+
+def import_benchmark(modules=('analysis', 'synthesis', 'file_ops')):
+    """Print import times and return False if a heavy module was loaded."""
+    passed = True
+    for module in modules:
+        best_time, heavy = time_import(module)
+        sys.stdout.write("import windenergytk.%-12s %8.1f ms  %s\n" %
+                         (module, best_time * 1000., ' '.join(heavy)))
+        if heavy:
+            passed = False
+    return passed
+
+
+def write_dat_files(directory, rows):
+    """Write the example dat file with rows data lines, plain and compressed.
+
+    INPUT
+    directory: (str) where to write the files
+    rows: (int) number of data lines, the example lines are repeated
+
+    OUTPUT
+    paths: (list) path of the plain file, then of each compressed copy
+    """
+    example = open(os.path.join(PACKAGE_DIR, 'examples', 'barnstable.dat'),
+                   'rb').read()
+    ## The header ends with the '***' line, column names and a blank line
+    lines = example.splitlines(True)
+    end = [line.startswith(b'***') for line in lines].index(True) + 3
+    header = b''.join(lines[:end])
+    data = [line.rstrip() + b'\r\n' for line in lines[end:] if line.strip()]
+    text = header + b''.join(data[row % len(data)] for row in range(rows))
+    
+    paths = [os.path.join(directory, 'bench.dat')]
+    open(paths[0], 'wb').write(text)
+    for module_name in ('gzip', 'bz2', 'lzma'):
+        try:
+            module = __import__(module_name)
+        except ImportError:
+            continue
+        path = paths[0] + {'gzip': '.gz', 'bz2': '.bz2',
+                           'lzma': '.xz'}[module_name]
+        compressed_file = module.open(path, 'wb')
+        compressed_file.write(text)
+        compressed_file.close()
+        paths.append(path)
+    return paths
+
+
+def time_read(path, background=True, repeat=3, rows=None):
+    """Time parsing all chunks of a dat file with file_ops.read_chunks.
+
+    Optional: rows (int) number of data lines the file should parse to
+
+    OUTPUT
+    best_time: (float) fastest time in seconds
+    """
+    from windenergytk import file_ops
+    times = []
+    for run in range(repeat):
+        start = time.time()
+        dat_file = file_ops.open_dat(path, background)
+        parsed_rows = 0
+        try:
+            for dates, values in file_ops.read_chunks(dat_file)[1]:
+                parsed_rows += len(values)
+        finally:
+            dat_file.close()
+        times.append(time.time() - start)
+        assert rows is None or parsed_rows == rows, \
+            "%s parsed to %d rows, not %d" % (path, parsed_rows, rows)
+    return min(times)
+
+
+def read_benchmark(rows=200000):
+    """Print parse throughput of plain and compressed dat files."""
+    if PACKAGE_DIR not in sys.path:
+        sys.path.insert(0, PACKAGE_DIR)
+    directory = tempfile.mkdtemp()
+    try:
+        paths = write_dat_files(directory, rows)
+        size = os.path.getsize(paths[0]) / 1e6
+        plain_time = time_read(paths[0], rows=rows)
+        sys.stdout.write("%-16s %10s %8.1f MB/s\n" %
+                         ('bench.dat', '', size / plain_time))
+        for path in paths[1:]:
+            for background in (False, True):
+                best_time = time_read(path, background, rows=rows)
+                sys.stdout.write("%-16s %10s %8.1f MB/s  %5.2fx plain\n" %
+                                 (os.path.basename(path),
+                                  background and 'background' or 'inline',
+                                  size / best_time, plain_time / best_time))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    passed = import_benchmark()
+    read_benchmark()
+    if not passed:
+        sys.exit(1)
@@ -33,6 +33,9 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
 ################################################################################
 
+import os
+import shutil
+import tempfile
 import unittest
 from windenergytk import analysis
 from windenergytk import synthesis
@@ -40,6 +43,9 @@ from windenergytk import aerodyn
 from windenergytk import electrical
 from windenergytk import mechanics
 from windenergytk import performance
+from windenergytk import file_ops
+from windenergytk import catalog
+import benchmarks
 
 import scikits.timeseries as ts
 import numpy
@@ -74,6 +80,27 @@ class AnalysisFunctions(unittest.TestCase):
         self.assertEqual(statistics_list[3], self.data.min())
         self.assertEqual(statistics_list[4], self.data.size)
 
+    def test_statistics_accumulator(self):
+        """Testing analysis.StatisticsAccumulator merged over chunks"""
+        first = analysis.StatisticsAccumulator()
+        second = analysis.StatisticsAccumulator()
+        for chunk in numpy.array_split(self.data[:400], 3):
+            first.add(chunk)
+        second.add(self.data[400:])
+        statistics_list = first.merge(second).get_statistics(output='list')
+        self.assertAlmostEqual(statistics_list[0], self.data.mean())
+        self.assertAlmostEqual(statistics_list[1], self.data.std())
+        self.assertEqual(statistics_list[2], self.data.max())
+        self.assertEqual(statistics_list[3], self.data.min())
+        self.assertEqual(statistics_list[4], self.data.size)
+        
+        ## Fully masked input gives masked statistics, as before
+        masked = numpy.ma.array(self.data, mask=True)
+        statistics_dict = analysis.get_statistics(masked)
+        for key in ('mean', 'std', 'max', 'min'):
+            self.assertTrue(statistics_dict[key] is numpy.ma.masked)
+        self.assertEqual(statistics_dict['size'], self.size)
+
     def test_histogram_data(self):
         """Test analysis.get_histogram_data()"""
         hdata = analysis.get_histogram_data(self.tseries, bins=10, normalized=True)
@@ -85,6 +112,30 @@ class AnalysisFunctions(unittest.TestCase):
         self.assertEqual(hdata[0].all(), numhdata[0].all())
         self.assertEqual(hdata[1].all(), numhdata[1].all())
     
+    def test_bulk_statistics(self):
+        """Testing analysis.get_bulk_statistics() against single sensors"""
+        data_array = numpy.ma.column_stack((self.data, self.data * 2.))
+        data_array[::10, 1] = numpy.ma.masked
+        bulk_stats = analysis.get_bulk_statistics(data_array, bins=10)
+        for sensor in range(2):
+            column = data_array[:, sensor].compressed()
+            stats = analysis.get_statistics(column)
+            c, k = analysis.get_weibull_params(stats['mean'], stats['std'])
+            hist, bin_edges = numpy.histogram(column, bins=10, normed=True)
+            self.assertAlmostEqual(bulk_stats['mean'][sensor], stats['mean'])
+            self.assertAlmostEqual(bulk_stats['std'][sensor], stats['std'])
+            self.assertEqual(bulk_stats['max'][sensor], stats['max'])
+            self.assertEqual(bulk_stats['min'][sensor], stats['min'])
+            self.assertEqual(bulk_stats['count'][sensor], column.size)
+            self.assertAlmostEqual(bulk_stats['weibull_c'][sensor], c)
+            self.assertAlmostEqual(bulk_stats['weibull_k'][sensor], k)
+            self.assertAlmostEqual(bulk_stats['turbulence_intensity'][sensor],
+                                   stats['std'] / stats['mean'])
+            for index in range(10):
+                self.assertAlmostEqual(bulk_stats['histogram'][sensor][index],
+                                       hist[index])
+        self.assertEqual(bulk_stats['size'], self.size)
+
     def test_weibull_params(self):
         """Testing analysis.get_weibull_params()"""
         ## Generate single variable weibull distribution
@@ -109,6 +160,69 @@ class AnalysisFunctions(unittest.TestCase):
         max_value_index = pxx.argmax()
         ## Assert that the highest density is at the cosine peak freq
         self.assertAlmostEqual(freq_list[max_value_index], 10, 0)
+
+    def test_welch_psd(self):
+        """Testing analysis.welch_psd() with overlap and detrending"""
+        t = numpy.arange(0., 10., .01)
+        ## 10 cosine waves per unit time on top of a constant offset
+        cos_data = 5. + numpy.cos(2. * numpy.pi * 10 * t)
+        freq_list, pxx = analysis.welch_psd(cos_data, 100, segment_size=200,
+                                            overlap=100, detrend='mean')
+        self.assertAlmostEqual(freq_list[pxx.argmax()], 10, 0)
+        ## Removing the mean leaves no power at zero frequency
+        self.assertAlmostEqual(pxx[0], 0)
+        self.assertEqual(len(freq_list), 101)
+
+    def test_crosscorrelate_methods(self):
+        """Testing analysis.crosscorrelate() fft against direct method"""
+        other = numpy.random.normal(self.mu, self.sigma, self.size // 2)
+        lags, fft_values = analysis.crosscorrelate(self.tseries, other, 50)
+        lags, direct_values = analysis.crosscorrelate(self.tseries, other, 50,
+                                                      method='direct')
+        self.assertEqual(len(lags), 51)
+        for index in range(len(lags)):
+            self.assertAlmostEqual(fft_values[index], direct_values[index])
+
+    def test_autocorrelate(self):
+        """Testing analysis.autocorrelate()"""
+        lags, values = analysis.autocorrelate(self.tseries)
+        ## Every lag with at least one overlapping value is returned
+        self.assertEqual(len(lags), self.size)
+        self.assertAlmostEqual(values[0], 1)
+
+    def test_autocorrelate_masked(self):
+        """Testing analysis.autocorrelate() leaves masked values out"""
+        ## Bad values stay under the mask, as parse_data() leaves them
+        data = self.data.copy()
+        data[[0, -1]] = -999.
+        masked = numpy.ma.masked_values(data, -999.)
+        for method in ('fft', 'direct'):
+            lags, values = analysis.autocorrelate(masked, 50, method)
+            lags, expected = analysis.autocorrelate(masked.compressed(), 50,
+                                                    method)
+            self.assertAlmostEqual(values[0], 1)
+            for index in range(len(lags)):
+                self.assertAlmostEqual(values[index], expected[index])
+
+    def test_block_statistics(self):
+        """Testing analysis.block_statistics()"""
+        block_stats = analysis.block_statistics(self.tseries, 'H')
+        averages = analysis.block_average(self.tseries, 'H')
+        ## 1000 minutes starting on the hour fill 17 hourly blocks
+        self.assertEqual(len(averages), 17)
+        self.assertEqual(block_stats['count'].sum(), self.size)
+        self.assertEqual(block_stats['count'][0], 60)
+        first_hour = self.data[:60]
+        self.assertAlmostEqual(averages[0], first_hour.mean())
+        
+        ## Blocks without valid values are left out
+        masked = ts.time_series(numpy.ma.array(self.data, mask=True),
+                                start_date="01-01-2001", freq="T")
+        for values in analysis.block_statistics(masked, 'H').values():
+            self.assertEqual(len(values), 0)
+        self.assertAlmostEqual(block_stats['std'][0], first_hour.std())
+        self.assertEqual(block_stats['max'][0], first_hour.max())
+        self.assertEqual(block_stats['min'][0], first_hour.min())
         
         
 
@@ -125,9 +239,105 @@ class SynthesisFunctions(unittest.TestCase):
         self.assertAlmostEqual(arma_ts.std(), stdev, 0)
         self.assertAlmostEqual(analysis.autocorrelate(arma_ts, 1)[1][1], autocor, 1)
         self.assertEqual(arma_ts.size, size)      
+
+    def test_ARMA_array(self):
+        """Testing synthesis.gen_arma_array() with several realisations"""
+        arma_array = synthesis.gen_arma_array(5., 2., 10000, [.5, .3], [.4],
+                                              nseries=3)
+        self.assertEqual(arma_array.shape, (3, 10000))
+        for row in arma_array:
+            self.assertAlmostEqual(row.mean(), 5., 0)
+            self.assertAlmostEqual(row.std(), 2., 0)
+        self.assertRaises(ValueError, synthesis.gen_arma_array, 0., 1., 10,
+                          [1.2])
     
-#    def test_gen_markov_tpm(self):
-#        """Testing synthesis.gen_markov_tpm()"""
+    def test_add_diurnal(self):
+        """Testing synthesis.add_diurnal()"""
+        tseries = ts.time_series(numpy.ones(1081), start_date="01-01-2001",
+                                 freq="T")
+        scaled = synthesis.add_diurnal(tseries, 24, .2)
+        ## The input is not modified
+        self.assertEqual(tseries.max(), 1.)
+        self.assertAlmostEqual(scaled[0], 1.)
+        self.assertAlmostEqual(scaled[360], 1.2)
+        ## The last value is scaled as well
+        self.assertAlmostEqual(scaled[1080], .8)
+        shifted = synthesis.add_diurnal(tseries, 24, .2, phase=numpy.pi / 2,
+                                        harmonics=[(12, .1, 0.)])
+        self.assertAlmostEqual(shifted[0], 1.2)
+        self.assertAlmostEqual(shifted[180], 1. + .2 * 2 ** -.5 + .1)
+
+    def test_gen_ensemble(self):
+        """Testing synthesis.gen_ensemble() does not depend on workers"""
+        args = (10., 2., 500, [.9])
+        serial = synthesis.gen_ensemble(synthesis.gen_arma_array, 6, 2009,
+                                        args, processes=1)
+        parallel = synthesis.gen_ensemble(synthesis.gen_arma_array, 6, 2009,
+                                          args, processes=2)
+        self.assertEqual(serial.shape, (6, 500))
+        self.assertTrue((serial == parallel).all())
+        ## Every realisation has its own stream
+        self.assertFalse((serial[0] == serial[1]).all())
+        self.assertRaises(ValueError, synthesis.gen_ensemble,
+                          synthesis.gen_arma_array, 2, 2009, args,
+                          {'nseries': 3}, processes=1)
+
+    def test_gen_pdf(self):
+        """Testing synthesis.gen_pdf() and gen_from_pdf()"""
+        bin_edges, probabilities = synthesis.gen_pdf(7., 3., .5)
+        self.assertEqual(len(bin_edges), len(probabilities) + 1)
+        self.assertAlmostEqual(probabilities.sum(), 1.)
+        data = synthesis.gen_from_pdf(bin_edges, probabilities, .9, 20000,
+                                      nseries=2)
+        self.assertEqual(data.shape, (2, 20000))
+        self.assertAlmostEqual(data[0].mean(), 7., 0)
+        self.assertAlmostEqual(data[0].std(), 3., 0)
+        self.assertAlmostEqual(analysis.autocorrelate(data[0], 1)[1][1], .9,
+                               1)
+
+    def test_gen_synthetic_tpm(self):
+        """Testing synthesis.gen_synthetic_tpm()"""
+        tpm = synthesis.gen_synthetic_tpm(7., 3., .9, .5)
+        for row_sum in tpm.sum(axis=1):
+            self.assertAlmostEqual(row_sum, 1., 5)
+        tseries = synthesis.gen_ts_from_tpm(tpm, .5, 20000)
+        self.assertAlmostEqual(tseries.mean(), 7., 0)
+
+    def test_gen_markov_tpm(self):
+        """Testing synthesis.gen_markov_tpm()"""
+        ## Alternating low and high values with one empty middle bin
+        tseries = numpy.ma.array([1., 5., 1., 5., 1., 5.])
+        tpm = synthesis.gen_markov_tpm(tseries, 3)
+        self.assertEqual(tpm[0].tolist(), [0., 0., 1.])
+        self.assertEqual(tpm[2].tolist(), [1., 0., 0.])
+        for value in tpm[1]:
+            self.assertAlmostEqual(value, 1. / 3)
+        ## Transitions into and out of masked values are not counted
+        tseries = numpy.ma.array([1., 5., 1., 1., 5.])
+        tseries[3] = numpy.ma.masked
+        tpm = synthesis.gen_markov_tpm(tseries, 3)
+        self.assertEqual(tpm[0].tolist(), [0., 0., 1.])
+
+    def test_gen_chains_from_tpm(self):
+        """Testing synthesis.gen_chains_from_tpm()"""
+        ## Chains alternate between bins, starting from the middle bin 1
+        tpm = numpy.array([[0., 1.], [1., 0.]])
+        chains = synthesis.gen_chains_from_tpm(tpm, 2., 100, nchains=4)
+        self.assertEqual(chains.shape, (4, 100))
+        self.assertTrue((chains[:, ::2] < 2.).all())
+        self.assertTrue((chains[:, 1::2] >= 2.).all())
+        ## Alias tables reproduce the row probabilities
+        tpm = numpy.array([[.1, .2, .7], [.5, .5, 0.], [0., 0., 1.]])
+        probability, alias = synthesis.gen_alias_tables(tpm)
+        for row in range(3):
+            implied = numpy.zeros(3)
+            for column in range(3):
+                implied[column] += probability[row, column] / 3.
+                implied[alias[row, column]] += \
+                    (1 - probability[row, column]) / 3.
+            for column in range(3):
+                self.assertAlmostEqual(implied[column], tpm[row, column])
+
 ## TODO finish Synthesis Unit tests
 
 class RotoraeroFunctions(unittest.TestCase):
@@ -144,6 +354,20 @@ class RotoraeroFunctions(unittest.TestCase):
                            [0.9, 0.41, 0.6],
                            [1.0, 0.37, 0]]
         
+        ## Chords in rotor radii and twist small enough to stay in range
+        ## after the angle conversion of rotor_analysis()
+        self.scaled_rct_matrix = numpy.array(self.rct_matrix)
+        self.scaled_rct_matrix[:, 1] /= 10.
+        self.scaled_rct_matrix[:, 2] = numpy.radians(
+            self.scaled_rct_matrix[:, 2]) / 57.29578
+        
+        ## Clipped thin airfoil lift and parabolic drag, -40 to 40 degrees
+        self.angles = numpy.radians(numpy.arange(-40., 41.))
+        self.lift_curve = numpy.column_stack((self.angles, numpy.clip(
+            2 * numpy.pi * self.angles + 0.2, -1., 1.4)))
+        self.drag_curve = numpy.column_stack(
+            (self.angles, 0.01 + 0.5 * self.angles ** 2))
+        
         ## TODO: create numbers for rotor performance testing
         self.rotor_stats = \
         {'number_blades': 3,
@@ -202,6 +426,182 @@ class RotoraeroFunctions(unittest.TestCase):
         self.assertAlmostEqual(linear_stats['angular_induction_factor'], self.rotor_stats['angular_induction_factor'])
         self.assertAlmostEqual(linear_stats['local_power_coefficient'], self.rotor_stats['local_power_coefficient'])
 
+    def test_rotor_analysis_array(self):
+        """Testing aerodyn.rotor_analysis_array() against rotor_analysis()"""
+        for method, lift, drag in (('linear', [2 * numpy.pi, 0.2],
+                                    [0., 0.01]),
+                                   ('nonlinear', self.lift_curve,
+                                    self.drag_curve)):
+            rotor_stats = aerodyn.rotor_analysis(
+                self.scaled_rct_matrix.copy(), 7., 3, 0., 10., 1., lift, drag,
+                method)
+            array_stats = aerodyn.rotor_analysis_array(
+                self.scaled_rct_matrix, 7., 3, 0., 10., 1., lift, drag, method)
+            self.assertEqual(array_stats.shape,
+                             (len(self.scaled_rct_matrix), 9))
+            self.assertTrue(numpy.allclose(array_stats, rotor_stats))
+            
+            ## Operating points are broadcast in front of the stations
+            array_stats = aerodyn.rotor_analysis_array(self.scaled_rct_matrix,
+                                                       [[6.], [7.]], 3,
+                                                       [0., 0.001], 10., 1.,
+                                                       lift, drag, method)
+            self.assertEqual(array_stats.shape,
+                             (2, 2, len(self.scaled_rct_matrix), 9))
+            self.assertTrue(numpy.allclose(array_stats[1, 0], rotor_stats))
+
+    def test_airfoil_polar(self):
+        """Testing aerodyn.AirfoilPolar() lookups and use as a lift curve"""
+        ## Unsorted input on a uniform grid is reproduced exactly
+        polar = aerodyn.AirfoilPolar(self.lift_curve[::-1], self.drag_curve)
+        test_angles = numpy.linspace(-0.6, 0.6, 25)
+        self.assertTrue(numpy.allclose(polar.lift(test_angles), numpy.interp(
+            test_angles, self.angles, self.lift_curve[:, 1])))
+        self.assertAlmostEqual(polar.drag(0.1), 0.01 + 0.5 * 0.1 ** 2, 3)
+        self.assertRaises(ValueError, polar.lift, 1.)
+        self.assertTrue(numpy.isnan(polar.lift(1., bounds_error=False)))
+        self.assertEqual(polar.angle_range, (self.angles[0], self.angles[-1]))
+
+        ## Nearly equal angles do not make the table finer than the limit
+        close_curve = numpy.vstack((self.lift_curve, [[1e-12, 0.2]]))
+        close_polar = aerodyn.AirfoilPolar(close_curve, self.drag_curve)
+        self.assertEqual(close_polar.lift_table[2].shape[1],
+                         aerodyn.MAX_TABLE_POINTS)
+        self.assertRaises(ValueError, aerodyn.AirfoilPolar, self.lift_curve,
+                          self.drag_curve, 1e-9)
+
+        ## Halfway between two Reynolds numbers
+        reynolds_polar = aerodyn.AirfoilPolar(
+            [self.lift_curve, self.lift_curve * [1., 2.]],
+            [self.drag_curve, self.drag_curve],
+            reynolds_numbers=[1e6, 2e6])
+        self.assertAlmostEqual(reynolds_polar.lift(0.1, 1.5e6),
+                               1.5 * polar.lift(0.1))
+        self.assertRaises(ValueError, reynolds_polar.lift, 0.1)
+        
+        rotor_stats = aerodyn.rotor_analysis(
+            self.scaled_rct_matrix.copy(), 7., 3, 0., 10., 1., self.lift_curve,
+            self.drag_curve, 'nonlinear')
+        polar_stats = aerodyn.rotor_analysis(
+            self.scaled_rct_matrix.copy(), 7., 3, 0., 10., 1., polar, None,
+            'nonlinear')
+        self.assertTrue(numpy.allclose(polar_stats, rotor_stats))
+        polar_stats = aerodyn.rotor_analysis_array(
+            self.scaled_rct_matrix, 7., 3, 0., 10., 1., polar, None,
+            'nonlinear')
+        self.assertTrue(numpy.allclose(polar_stats, rotor_stats))
+
+    def test_bracket_solver(self):
+        """Testing the bracketed root solver of the nonlinear method"""
+        polar = aerodyn.AirfoilPolar(self.lift_curve, self.drag_curve)
+        fradius = self.scaled_rct_matrix[:, 0]
+        local_solidity = 3 * self.scaled_rct_matrix[:, 1] / (
+            2 * numpy.pi * fradius * 10.)
+        local_pitch = numpy.radians(numpy.array(self.rct_matrix)[:, 2])
+        
+        results = aerodyn.nonlinear_method_factors_array(
+            fradius, 3, local_pitch, 7. * fradius, polar, None,
+            local_solidity, solver='bracket', tolerance=1e-8,
+            max_iterations=50, return_iterations=True)
+        (local_tip_loss, angle_of_attack, angle_of_rwind, lift_coefficient,
+         drag_coefficient, axial_induc_factor, angular_induc_factor,
+         iterations) = results
+        
+        ## The empirical lift coefficient meets the BEMT one
+        bemt_lift_coef = aerodyn.bemt_lift_coefficient(
+            local_tip_loss, local_solidity, angle_of_rwind, 7. * fradius)
+        self.assertTrue(numpy.allclose(lift_coefficient, bemt_lift_coef,
+                                       atol=1e-4))
+        ## Iterations count the 81 evaluations of the 1 degree grid
+        self.assertTrue((iterations > 81).all())
+        self.assertTrue((iterations < 81 + 50).all())
+        
+        ## The scalar method gives the same station results
+        station = aerodyn.nonlinear_method_factors(
+            fradius[3], 3, local_pitch[3], 7. * fradius[3], polar, None,
+            local_solidity[3], solver='bracket', tolerance=1e-8,
+            max_iterations=50, return_iterations=True)
+        self.assertAlmostEqual(station[1], angle_of_attack[3])
+        self.assertEqual(station[-1], iterations[3])
+        station = aerodyn.nonlinear_method_factors(
+            fradius[3], 3, local_pitch[3], 7. * fradius[3], polar, None,
+            local_solidity[3], max_iterations=3, return_iterations=True)
+        self.assertEqual(station[-1], 3)
+
+    def test_rotor_cache(self):
+        """Testing aerodyn.RotorCache() hits, misses and eviction"""
+        cache = aerodyn.RotorCache(maxsize=1)
+        
+        rotor_stats = aerodyn.rotor_analysis_array(
+            self.scaled_rct_matrix, 7., 3, 0., 10., 1., [2 * numpy.pi, 0.2],
+            [0., 0.01], 'linear', cache=cache)
+        rotor_stats[0, 0] = -1.
+        cached_stats = aerodyn.rotor_analysis_array(
+            self.scaled_rct_matrix.tolist(), 7, 3, 0, 10, 1,
+            [2 * numpy.pi, 0.2], [0., 0.01], 'linear', cache=cache)
+        self.assertEqual(cache.info()['hits'], 1)
+        self.assertEqual(cached_stats[0, 0], 1.)
+        
+        ## Another operating point pushes the first result out
+        for tip_speed_ratio in (6., 7.):
+            aerodyn.rotor_analysis_array(self.scaled_rct_matrix,
+                                         tip_speed_ratio, 3, 0., 10., 1.,
+                                         [2 * numpy.pi, 0.2], [0., 0.01],
+                                         'linear', cache=cache)
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 3, 'size': 1,
+                                        'maxsize': 1})
+        self.assertTrue(cache.get('unknown') is aerodyn.RotorCache.MISSING)
+        self.assertRaises(ValueError, aerodyn.RotorCache, 0)
+
+        unbounded = aerodyn.RotorCache(maxsize=None)
+        for key in range(3):
+            unbounded[str(key)] = key
+        self.assertEqual(len(unbounded), 3)
+        self.assertEqual(unbounded.get('0'), 0)
+
+        ## Results on disk are found by a new cache
+        temp_dir = tempfile.mkdtemp()
+        try:
+            for expected_hits in (0, 1):
+                cache = aerodyn.RotorCache(directory=temp_dir)
+                aerodyn.rotor_analysis(self.scaled_rct_matrix.copy(), 7., 3,
+                                       0., 10., 1., [2 * numpy.pi, 0.2],
+                                       [0., 0.01], 'linear', cache=cache)
+                self.assertEqual(cache.hits, expected_hits)
+            
+            ## A partly written result is a miss
+            for name in os.listdir(temp_dir):
+                open(os.path.join(temp_dir, name), 'wb').write(b'\x80\x02')
+            cache = aerodyn.RotorCache(directory=temp_dir)
+            aerodyn.rotor_analysis(self.scaled_rct_matrix.copy(), 7., 3, 0.,
+                                   10., 1., [2 * numpy.pi, 0.2], [0., 0.01],
+                                   'linear', cache=cache)
+            self.assertEqual(cache.info()['misses'], 1)
+            self.assertEqual(len(os.listdir(temp_dir)), 1)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_performance_surface(self):
+        """Testing aerodyn.performance_surface() against rotor_analysis()"""
+        tip_speed_ratios, pitches = [5., 7.], [0., 0.001, 0.002]
+        
+        surfaces = aerodyn.performance_surface(self.scaled_rct_matrix,
+                                               tip_speed_ratios, pitches, 3,
+                                               10., 1., [2 * numpy.pi, 0.2],
+                                               [0., 0.01], 'linear',
+                                               processes=1)
+        self.assertEqual(surfaces['power_coef'].shape, (2, 3))
+        for row, tip_speed_ratio in enumerate(tip_speed_ratios):
+            for column, pitch in enumerate(pitches):
+                rotor_stats = aerodyn.rotor_analysis(
+                    self.scaled_rct_matrix.copy(), tip_speed_ratio, 3, pitch,
+                    10., 1., [2 * numpy.pi, 0.2], [0., 0.01], 'linear')
+                power_coef = numpy.array(rotor_stats)[:, 8].sum()
+                self.assertAlmostEqual(surfaces['power_coef'][row, column],
+                                       power_coef)
+                self.assertAlmostEqual(surfaces['torque_coef'][row, column],
+                                       power_coef / tip_speed_ratio)
+
 class MechanicsFunctions(unittest.TestCase):
     def setUp(self):
         self.beam_length = 10
@@ -324,6 +724,229 @@ class PerformanceFunctions(unittest.TestCase):
     
     
     
+class FileFunctions(unittest.TestCase):
+    """Tests for the file operations."""
+    def setUp(self):
+        self.dat_path = os.path.join(os.path.dirname(__file__), '..',
+                                     'examples', 'barnstable.dat')
+        self.rows, self.sensors = 32, 18
+
+    def test_read_chunks(self):
+        """Testing file_ops.read_chunks()"""
+        meta_dict, chunks = file_ops.read_chunks(open(self.dat_path), 10)
+        self.assertEqual(meta_dict['site_name'], 'barnstable')
+        chunks = list(chunks)
+        self.assertEqual([len(dates) for dates, values in chunks],
+                         [10, 10, 10, 2])
+        dates, values = chunks[0]
+        self.assertEqual(values.shape, (10, self.sensors))
+        ## -988 (dissimilar sensors) is masked
+        self.assertEqual(values.mask[:3, 2].tolist(), [True, True, False])
+        self.assertEqual(values[2, 2], 2.5)
+        self.assertEqual(dates[1] - dates[0], 10)
+
+    def test_binary_cache(self):
+        """Testing file_ops.load_data() with the binary cache"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'barnstable.dat')
+            shutil.copy(self.dat_path, path)
+            self.assertEqual(file_ops.read_cache(path), None)
+            meta_dict, parsed = file_ops.load_data(path)
+            cached_meta, cached = file_ops.read_cache(path)
+            self.assertEqual(cached_meta, meta_dict)
+            self.assertEqual(cached.shape, (self.rows, self.sensors))
+            self.assertTrue((cached.mask == parsed.mask).all())
+            self.assertTrue((cached.filled(0) == parsed.filled(0)).all())
+            self.assertTrue((cached.dates == parsed.dates).all())
+            ## A changed file is parsed again
+            open(path, 'a').write('\n')
+            self.assertEqual(file_ops.read_cache(path), None)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_data_recovery(self):
+        """Testing file_ops.parse_file() filter masking and data recovery"""
+        meta_ts_dict = file_ops.parse_file(open(self.dat_path))
+        self.assertEqual(len(meta_ts_dict), self.sensors)
+        ## Sensor 3 has two -988 (dissimilar sensors) values
+        self.assertEqual(meta_ts_dict[3]['timeseries'].count(), 30)
+        self.assertEqual(meta_ts_dict[3]['valid_count'], 30)
+        self.assertAlmostEqual(meta_ts_dict[3]['data_recovery'], 30 / 32.)
+        self.assertEqual(meta_ts_dict[1]['data_recovery'], 1.)
+
+    def test_filter_mask(self):
+        """Testing file_ops.filter_mask()"""
+        values = numpy.array([[1., -999.], [-991., 4.]])
+        self.assertEqual(file_ops.filter_mask(values, [-999, -991]).tolist(),
+                         [[False, True], [True, False]])
+
+    def test_ingest(self):
+        """Testing file_ops.ingest() joining overlapping and gapped files"""
+        lines = open(self.dat_path).readlines()
+        header = lines[:lines.index('***\n') + 3]
+        data = [line for line in lines[len(header):] if line.strip()]
+        temp_dir = tempfile.mkdtemp()
+        try:
+            ## Rows 10 and 11 are in both files, rows 20 to 24 in neither
+            open(os.path.join(temp_dir, 'a.dat'), 'w').writelines(
+                header + data[:12])
+            open(os.path.join(temp_dir, 'b.dat'), 'w').writelines(
+                header + data[10:20] + data[25:])
+            open(os.path.join(temp_dir, 'c.dat'), 'w').write('no header\n')
+            meta_ts_dict, report = file_ops.ingest(temp_dir, processes=2,
+                                                   cache=False)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual([entry['rows'] for entry in report], [12, 17, 0])
+        self.assertEqual(report[0]['error'], None)
+        self.assertNotEqual(report[2]['error'], None)
+        tseries = meta_ts_dict[1]['timeseries']
+        self.assertEqual(len(tseries), self.rows)
+        self.assertEqual(tseries.mask[20:25].tolist(), [True] * 5)
+        self.assertEqual(meta_ts_dict[1]['valid_count'], self.rows - 5)
+
+    def test_parse_lines(self):
+        """Testing file_ops.parse_lines() with empty and filtered fields"""
+        dates, values = file_ops.parse_lines(['2006-01-01 00:00,1.5,,-999\n',
+                                              '2006-01-01 00:10,2,3,4\n'],
+                                             [-999])
+        self.assertEqual(values.mask.tolist(), [[False, True, True],
+                                                [False, False, False]])
+        self.assertEqual(values[1].tolist(), [2., 3., 4.])
+
+    def test_compressed_input(self):
+        """Testing file_ops.open_dat() with gzip and bz2 files"""
+        import bz2
+        import gzip
+        temp_dir = tempfile.mkdtemp()
+        try:
+            text = open(self.dat_path, 'rb').read()
+            for module, suffix in ((gzip, '.gz'), (bz2, '.bz2')):
+                path = os.path.join(temp_dir, 'barnstable.dat' + suffix)
+                compressed_file = module.open(path, 'wb')
+                compressed_file.write(text)
+                compressed_file.close()
+                for background in (True, False):
+                    dat_file = file_ops.open_dat(path, background)
+                    meta_dict, timeseries = file_ops.parse_data(dat_file)
+                    dat_file.close()
+                    self.assertEqual(meta_dict['site_name'], 'barnstable')
+                    self.assertEqual(timeseries.shape,
+                                     (self.rows, self.sensors))
+                meta_dict, chunks = file_ops.read_chunks(path, 10)
+                self.assertEqual(sum(len(dates) for dates, values in chunks),
+                                 self.rows)
+            self.assertEqual(len(file_ops.find_files(temp_dir)), 2)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_tail_reader(self):
+        """Testing file_ops.TailReader() on a file growing line by line"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            lines = open(self.dat_path, 'rb').readlines()
+            data_start = len(lines) - self.rows
+            path = os.path.join(temp_dir, 'barnstable.dat')
+            open(path, 'wb').write(b''.join(lines[:data_start + 10]) +
+                                   lines[data_start + 10][:5])
+            reader = file_ops.TailReader(path)
+            self.assertEqual(reader.update(), 10)
+            
+            ## Finish the partial line and append the rest, the last line
+            ## of the example has no line end
+            open(path, 'ab').write(lines[data_start + 10][5:] +
+                                   b''.join(lines[data_start + 11:]) + b'\n')
+            self.assertEqual(reader.update(), self.rows - 10)
+            self.assertEqual(reader.update(), 0)
+            
+            timeseries = file_ops.parse_data(path)[1]
+            self.assertEqual(reader.timeseries.shape, timeseries.shape)
+            self.assertTrue((reader.timeseries.mask ==
+                             timeseries.mask).all())
+            self.assertAlmostEqual(reader.get_statistics()[3]['mean'],
+                                   timeseries[:, 2].mean())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_lazy_parse(self):
+        """Testing file_ops.parse_file() with lazy sensor entries"""
+        meta_ts_dict = file_ops.parse_file(open(self.dat_path), lazy=True)
+        self.assertEqual(len(meta_ts_dict), self.sensors)
+        entry = meta_ts_dict[3]
+        self.assertEqual(entry['site_name'], 'barnstable')
+        self.assertFalse(entry.loaded('timeseries'))
+        self.assertEqual(len(entry['timeseries']), self.rows)
+        self.assertTrue(entry.loaded('timeseries'))
+        entry['site_name'] = 'other'
+        self.assertEqual(meta_ts_dict[4]['site_name'], 'barnstable')
+        self.assertEqual(type(entry.copy()), dict)
+
+
+class CatalogFunctions(unittest.TestCase):
+    """Tests for the data archive catalog."""
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.dat_path = os.path.join(self.temp_dir, 'barnstable.dat')
+        shutil.copy(os.path.join(os.path.dirname(__file__), '..', 'examples',
+                                 'barnstable.dat'), self.dat_path)
+        self.connection = catalog.open_catalog(':memory:')
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_refresh_catalog(self):
+        """Testing catalog.refresh_catalog() only reads changed files"""
+        changes = catalog.refresh_catalog(self.connection, self.temp_dir)
+        self.assertEqual(changes['added'], 1)
+        changes = catalog.refresh_catalog(self.connection, self.temp_dir)
+        self.assertEqual(changes['unchanged'], 1)
+        os.remove(self.dat_path)
+        changes = catalog.refresh_catalog(self.connection, self.temp_dir)
+        self.assertEqual(changes['removed'], 1)
+        self.assertEqual(catalog.find_sensors(self.connection), [])
+
+    def test_find_sensors(self):
+        """Testing catalog.find_sensors()"""
+        catalog.refresh_catalog(self.connection, self.temp_dir)
+        path = os.path.abspath(self.dat_path)
+        self.assertEqual(catalog.find_sensors(self.connection,
+                                              site_name='Barnstable',
+                                              sensor_type='anemometer',
+                                              height=39),
+                         [(path, 3), (path, 5)])
+        self.assertEqual(len(catalog.find_sensors(self.connection,
+                                                  start_date='2006-02-01',
+                                                  end_date='2006-03-01')),
+                         18)
+        self.assertEqual(catalog.find_sensors(self.connection,
+                                              start_date='2006-04-04'), [])
+
+    def test_decimal_height(self):
+        """Testing catalog.find_sensors() with a decimal sensor height"""
+        text = open(self.dat_path, 'rb').read()
+        open(self.dat_path, 'wb').write(text.replace(
+            b'Anemometer,Primary,39,', b'Anemometer,Primary,39.5,'))
+        catalog.refresh_catalog(self.connection, self.temp_dir)
+        path = os.path.abspath(self.dat_path)
+        self.assertEqual(catalog.find_sensors(self.connection, height=39.5),
+                         [(path, 3)])
+        self.assertEqual(catalog.find_sensors(self.connection,
+                                              sensor_type='anemometer',
+                                              height='39'),
+                         [(path, 5)])
+
+
+class ImportFunctions(unittest.TestCase):
+    """Tests that heavy dependencies are only imported on use."""
+    def test_lazy_imports(self):
+        """Testing that core modules import without heavy backends"""
+        for module in ('analysis', 'synthesis', 'file_ops'):
+            best_time, heavy = benchmarks.time_import(module, repeat=1)
+            self.assertEqual(heavy, [])
+
+
 ## TODO: Finish  synthesis functions
 ## finish aero tests
 ## finish mechanics tests
@@ -336,5 +959,9 @@ suite3 = unittest.TestLoader().loadTestsFromTestCase(RotoraeroFunctions)
 suite4 = unittest.TestLoader().loadTestsFromTestCase(MechanicsFunctions)
 suite5 = unittest.TestLoader().loadTestsFromTestCase(ElectricalFunctions)
 suite6 = unittest.TestLoader().loadTestsFromTestCase(PerformanceFunctions)
-alltests = unittest.TestSuite((suite1, suite2, suite3, suite4, suite5, suite6))
+suite7 = unittest.TestLoader().loadTestsFromTestCase(ImportFunctions)
+suite8 = unittest.TestLoader().loadTestsFromTestCase(FileFunctions)
+suite9 = unittest.TestLoader().loadTestsFromTestCase(CatalogFunctions)
+alltests = unittest.TestSuite((suite1, suite2, suite3, suite4, suite5, suite6,
+                               suite7, suite8, suite9))
 unittest.TextTestRunner(verbosity=2).run(alltests)
@@ -33,9 +33,18 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
 ################################################################################
 
+from collections import OrderedDict
+import copy
+import hashlib
+import os
+import pickle
+import tempfile
+
 import numpy
 from scipy.interpolate import interp1d
 
+from windenergytk.analysis import _pool_map
+
 
 def deg_rad(conversion, *args):
     """Take an optional amount of values and convert between degrees/radians.
@@ -166,6 +175,25 @@ def tip_loss(number_of_blades, fractional_radius, angle_of_rwind):
     return 0
 
 
+def tip_loss_array(number_blades, fractional_radius, angle_of_rwind):
+    """Array version of tip_loss(), for many stations at once.
+    
+    INPUT
+    number_blades: (int)
+    fractional_radius: (array-like) local radius / total radius
+    angle_of_rwind: (array-like) angle of relative wind
+    
+    OUTPUT
+    tip_loss: (ndarray)
+    """
+    with numpy.errstate(all='ignore'):
+        tmp = numpy.exp(-(number_blades / 2) * (1 - fractional_radius) /
+                        (fractional_radius * numpy.sin(angle_of_rwind)))
+        valid = (tmp > 0) & ((1 - tmp**2) > 0)
+        return numpy.where(valid, numpy.arctan((numpy.sqrt(1 - tmp**2) / tmp)
+                                               / (numpy.pi/2)), 1.)
+
+
 def rotor_coefs(axial_induc_factor, angular_induc_factor, angle_of_rwind, 
                 tip_speed_ratio, local_tsr, num_stations, local_solidity, 
                 lift_coefficient, drag_coefficient, local_tip_loss):
@@ -261,7 +289,9 @@ def linear_method_factors(fradius, number_blades, local_pitch, local_tsr,
            drag_coefficient, axial_induc_factor, angular_induc_factor
 
 def nonlinear_method_factors(fradius, number_blades, local_pitch, local_tsr,
-                             lift_curve, drag_curve, local_solidity):
+                             lift_curve, drag_curve, local_solidity,
+                             solver='step', tolerance=1e-6,
+                             max_iterations=None, return_iterations=False):
     """Get angle of attack, relative wind, induction factors w/ nonlinear curve.
 
     INPUT
@@ -269,9 +299,19 @@ def nonlinear_method_factors(fradius, number_blades, local_pitch, local_tsr,
     number_blades:      (int) number of blades
     local_pitch:        (float) local pitch in radians
     local_tsr:          (float) local tip speed ratio
-    lift_curve:         (float) array of empirical lift_coef vs. AoA curve
-    drag_curve:         (float) array of empirical drag_coef vs. AoA curve
+    lift_curve:         (float) array of empirical lift_coef vs. AoA curve,
+                        or an AirfoilPolar
+    drag_curve:         (float) array of empirical drag_coef vs. AoA curve,
+                        not used with an AirfoilPolar
     local_solidity:     (float) local solidity
+    solver:             (str) 'step' increments the angle of attack,
+                        'bracket' uses the bracketed root search of
+                        nonlinear_method_factors_array()
+    tolerance:          (float) angle of attack tolerance of 'bracket', rad
+    max_iterations:     (int) stop after this many iterations, no limit
+                        for 'step' and 100 for 'bracket' by default
+    return_iterations:  (boolean) add the number of lift coefficient
+                        differences evaluated to the output
     
     OUTPUT
     local_tip_loss: (float)
@@ -281,31 +321,45 @@ def nonlinear_method_factors(fradius, number_blades, local_pitch, local_tsr,
     drag_coefficient: (float)
     axial_induc_factor: (float)
     angular_induc_factor: (float)
+    iterations: (int) only if return_iterations
     """
-    ## TODO
-    ## Remove all but necessary calculations from loop
+    if solver != 'step':
+        results = nonlinear_method_factors_array(
+            fradius, number_blades, local_pitch, local_tsr, lift_curve,
+            drag_curve, local_solidity, max_iterations, solver=solver,
+            tolerance=tolerance, return_iterations=True)
+        factors = tuple(float(result) for result in results[:-1])
+        if return_iterations:
+            return factors + (int(results[-1]),)
+        return factors
 
     lift_coef_epsilon = 10.
     angle_of_attack = 0.
+    iterations = 0
     
     ## increment of "1 deg" in radians for changing AoA
     angle_delta = 0.0174532925
 
-    ## Transpose curves to make interpolation easier
-    ## Going from [[AoA, lift_coef]..] to
-    ## [[AoA, AoA2...],[lift_coef, lift_coef2]]
-    lift_curve = numpy.array(lift_curve).transpose()
-    drag_curve = numpy.array(drag_curve).transpose()
+    if isinstance(lift_curve, AirfoilPolar):
+        interp_lift_curve, interp_drag_curve = lift_curve.lift, lift_curve.drag
+    else:
+        ## Transpose curves to make interpolation easier
+        ## Going from [[AoA, lift_coef]..] to
+        ## [[AoA, AoA2...],[lift_coef, lift_coef2]]
+        lift_curve = numpy.array(lift_curve).transpose()
+        drag_curve = numpy.array(drag_curve).transpose()
+        interp_lift_curve = interp1d(lift_curve[0], lift_curve[1])
+        interp_drag_curve = interp1d(drag_curve[0], drag_curve[1])
     
     ## Find where empirical and Blade Element Momentum Theory
     ## lift coef vs. angle of attack curves meet
-    while (lift_coef_epsilon > 0.01) and (angle_delta > 0.001):
-        
+    while (lift_coef_epsilon > 0.01) and (angle_delta > 0.001) and \
+          (max_iterations is None or iterations < max_iterations):
+        iterations += 1
         angle_of_rwind = local_pitch + angle_of_attack
         local_tip_loss = tip_loss(number_blades, fradius, angle_of_rwind)
 
         ## Use input lift coef vs. angle of attack
-        interp_lift_curve = interp1d(lift_curve[0],lift_curve[1])
         empirical_lift_coef = float(interp_lift_curve(angle_of_attack))
         
         ## From 3.10.1.3 Manwell et. al.
@@ -339,12 +393,505 @@ def nonlinear_method_factors(fradius, number_blades, local_pitch, local_tsr,
             angle_of_attack += angle_delta
 
             
-    interp_drag_curve = interp1d(drag_curve[0],drag_curve[1])
     drag_coefficient = float(interp_drag_curve(angle_of_attack))
 
+    if return_iterations:
+        return local_tip_loss, angle_of_attack, angle_of_rwind, \
+               empirical_lift_coef, drag_coefficient, axial_induc_factor, \
+               angular_induc_factor, iterations
     return local_tip_loss, angle_of_attack, angle_of_rwind, empirical_lift_coef,\
            drag_coefficient, axial_induc_factor, angular_induc_factor
 
+
+def linear_method_factors_array(fradius, number_blades, local_pitch, local_tsr,
+                                lift_coef_slope, lift_coef_intercept,
+                                drag_coef_slope, drag_coef_intercept,
+                                local_solidity, max_iterations=1000,
+                                return_iterations=False):
+    """Array version of linear_method_factors(), for all stations at once.
+
+    Every station repeats the tip loss iteration of linear_method_factors()
+    until its own tip loss changes by less than 0.01. Converged stations
+    are dropped from further iterations.
+
+    INPUT
+    fradius, local_pitch, local_tsr, local_solidity: (array-like) of the
+                        stations, broadcast against each other
+    number_blades, lift_coef_slope, lift_coef_intercept, drag_coef_slope,
+    drag_coef_intercept: (float) as in linear_method_factors()
+    max_iterations:     (int) stop stations that have not converged after
+                        this many iterations
+    return_iterations:  (boolean) add the iterations of each station to
+                        the output
+
+    OUTPUT
+    Tuple of arrays, as linear_method_factors()
+    iterations:         (int ndarray) only if return_iterations
+    """
+    arrays = numpy.broadcast_arrays(*[numpy.asarray(value, dtype=float)
+                                      for value in (fradius, local_pitch,
+                                                    local_tsr,
+                                                    local_solidity)])
+    fradius, local_pitch, local_tsr, local_solidity = arrays
+    
+    local_tip_loss = numpy.ones(fradius.shape)
+    results = [numpy.zeros(fradius.shape) for index in range(6)]
+    iterations = numpy.zeros(fradius.shape, dtype=int)
+    active = numpy.ones(fradius.shape, dtype=bool)
+    
+    with numpy.errstate(all='ignore'):
+        for iteration in range(max_iterations):
+            if not active.any():
+                break
+            iterations[active] += 1
+            pitch, tip_loss_value = local_pitch[active], local_tip_loss[active]
+            solidity = local_solidity[active]
+            
+            q1, q2, q3 = q_terms(pitch, tip_loss_value, lift_coef_slope,
+                                 lift_coef_intercept, solidity)
+            angle_of_attack = calc_attack_angle(q1, q2, q3)
+            angle_of_rwind = pitch + angle_of_attack
+            lift_coefficient = (angle_of_attack *
+                                lift_coef_slope) + lift_coef_intercept
+            axial_induc_factor = calc_axial_factor(tip_loss_value,
+                                                   lift_coefficient,
+                                                   angle_of_rwind, solidity)
+            angular_induc_factor = calc_angular_factor(axial_induc_factor,
+                                                       angle_of_rwind,
+                                                       local_tsr[active])
+            drag_coefficient = (drag_coef_slope *
+                                angle_of_attack) + drag_coef_intercept
+            
+            for result, value in zip(results, (angle_of_attack,
+                                               angle_of_rwind,
+                                               lift_coefficient,
+                                               drag_coefficient,
+                                               axial_induc_factor,
+                                               angular_induc_factor)):
+                result[active] = value
+            
+            ## Calculate new tip loss, stations stop when it settles
+            new_tip_loss = tip_loss_array(number_blades, fradius[active],
+                                          angle_of_rwind)
+            converged = ~(abs(new_tip_loss - tip_loss_value) > 0.01)
+            local_tip_loss[active] = new_tip_loss
+            active[active] = ~converged
+    
+    if return_iterations:
+        return (local_tip_loss,) + tuple(results) + (iterations,)
+    return (local_tip_loss,) + tuple(results)
+
+
+def nonlinear_method_factors_array(fradius, number_blades, local_pitch,
+                                   local_tsr, lift_curve, drag_curve,
+                                   local_solidity, max_iterations=None,
+                                   bounds_error=True, solver='step',
+                                   tolerance=1e-6, return_iterations=False):
+    """Array version of nonlinear_method_factors(), for all stations at once.
+
+    With solver='step' every station steps its angle of attack as
+    nonlinear_method_factors() does, until the empirical and BEMT lift
+    coefficients are within 0.01 or the step is below 0.001 rad.
+
+    With solver='bracket' the difference of the two lift coefficients is
+    tabulated for every station on a 1 degree grid of the curve range, and
+    the root closest above 0 (or else closest below 0) is bracketed and
+    refined with the Illinois method to within tolerance. Stations without
+    a root get NaN results. Its iterations include the grid evaluations,
+    max_iterations only limits the refinement.
+
+    Converged stations are dropped from further iterations.
+
+    INPUT
+    fradius, local_pitch, local_tsr, local_solidity: (array-like) of the
+                        stations, broadcast against each other
+    number_blades, lift_curve, drag_curve: as in nonlinear_method_factors(),
+                        pass an AirfoilPolar to use its resampled tables
+    max_iterations:     (int) stop stations that have not converged after
+                        this many iterations, by default 10000 for 'step'
+                        and 100 for 'bracket'
+    bounds_error:       (boolean) raise ValueError if an angle of attack
+                        leaves the curves, otherwise such stations stop
+                        with NaN results ('step' only)
+    solver:             (str) 'step' or 'bracket'
+    tolerance:          (float) angle of attack tolerance of 'bracket', rad
+    return_iterations:  (boolean) add the number of lift coefficient
+                        differences evaluated for each station to the
+                        output
+
+    OUTPUT
+    Tuple of arrays, as nonlinear_method_factors()
+    iterations:         (int ndarray) only if return_iterations
+    """
+    arrays = numpy.broadcast_arrays(*[numpy.asarray(value, dtype=float)
+                                      for value in (fradius, local_pitch,
+                                                    local_tsr,
+                                                    local_solidity)])
+    
+    if isinstance(lift_curve, AirfoilPolar):
+        lift, drag = lift_curve.lift, lift_curve.drag
+        angle_range = lift_curve.angle_range
+    else:
+        lift, drag = _Curve(lift_curve), _Curve(drag_curve)
+        angle_range = (max(lift.angles[0], drag.angles[0]),
+                       min(lift.angles[-1], drag.angles[-1]))
+    
+    with numpy.errstate(all='ignore'):
+        if solver == 'step':
+            results, iterations = _step_solve(
+                number_blades, lift, drag, max_iterations or 10000,
+                bounds_error, *arrays)
+        elif solver == 'bracket':
+            results, iterations = _bracket_solve(
+                number_blades, lift, drag, angle_range,
+                max_iterations or 100, tolerance, *arrays)
+        else:
+            raise ValueError("Unknown solver %r" % (solver,))
+    
+    if return_iterations:
+        return results + (iterations,)
+    return results
+
+
+def _step_solve(number_blades, lift, drag, max_iterations, bounds_error,
+                fradius, local_pitch, local_tsr, local_solidity):
+    """Angle of attack stepping of nonlinear_method_factors() on arrays."""
+    angle_of_attack = numpy.zeros(fradius.shape)
+    angle_delta = numpy.empty(fradius.shape)
+    angle_delta.fill(0.0174532925)
+    lift_coef_epsilon = numpy.empty(fradius.shape)
+    lift_coef_epsilon.fill(10.)
+    results = [numpy.zeros(fradius.shape) for index in range(5)]
+    iterations = numpy.zeros(fradius.shape, dtype=int)
+    active = numpy.ones(fradius.shape, dtype=bool)
+    
+    for iteration in range(max_iterations):
+        if not active.any():
+            break
+        iterations[active] += 1
+        attack, delta = angle_of_attack[active], angle_delta[active]
+        solidity, tsr = local_solidity[active], local_tsr[active]
+        
+        angle_of_rwind = local_pitch[active] + attack
+        local_tip_loss = tip_loss_array(number_blades, fradius[active],
+                                        angle_of_rwind)
+        empirical_lift_coef = lift(attack, bounds_error=bounds_error)
+        bemt_lift_coef = bemt_lift_coefficient(local_tip_loss, solidity,
+                                               angle_of_rwind, tsr)
+        axial_induc_factor = calc_axial_factor(local_tip_loss,
+                                               empirical_lift_coef,
+                                               angle_of_rwind, solidity)
+        angular_induc_factor = calc_angular_factor(axial_induc_factor,
+                                                   angle_of_rwind, tsr)
+        for result, value in zip(results, (local_tip_loss,
+                                           angle_of_rwind,
+                                           empirical_lift_coef,
+                                           axial_induc_factor,
+                                           angular_induc_factor)):
+            result[active] = value
+        
+        ## Keep stepping stations that approach the solution, go back
+        ## and make the step smaller on the others
+        epsilon = abs(empirical_lift_coef - bemt_lift_coef)
+        approaching = epsilon < lift_coef_epsilon[active]
+        angle_of_attack[active] = numpy.where(approaching,
+                                              attack + delta,
+                                              (attack - delta) +
+                                              .707 * delta)
+        delta = numpy.where(approaching, delta, .707 * delta)
+        angle_delta[active] = delta
+        lift_coef_epsilon[active] = epsilon
+        active[active] = (epsilon > 0.01) & (delta > 0.001)
+    
+    (local_tip_loss, angle_of_rwind, lift_coefficient, axial_induc_factor,
+     angular_induc_factor) = results
+    drag_coefficient = drag(angle_of_attack, bounds_error=bounds_error)
+    
+    return (local_tip_loss, angle_of_attack, angle_of_rwind,
+            lift_coefficient, drag_coefficient, axial_induc_factor,
+            angular_induc_factor), iterations
+
+
+def _bracket_solve(number_blades, lift, drag, angle_range, max_iterations,
+                   tolerance, fradius, local_pitch, local_tsr,
+                   local_solidity):
+    """Bracketed Illinois root search of the lift coefficient difference."""
+    shape = fradius.shape
+    fradius, local_pitch, local_tsr, local_solidity = [
+        value.ravel() for value in (fradius, local_pitch, local_tsr,
+                                    local_solidity)]
+    
+    def residual(attack, index):
+        angle_of_rwind = local_pitch[index] + attack
+        local_tip_loss = tip_loss_array(number_blades, fradius[index],
+                                        angle_of_rwind)
+        return (lift(attack, bounds_error=False) -
+                bemt_lift_coefficient(local_tip_loss, local_solidity[index],
+                                      angle_of_rwind, local_tsr[index]))
+    
+    ## Tabulate the residual of all stations on a 1 degree grid
+    start, stop = angle_range
+    grid = numpy.linspace(start, stop, int(numpy.ceil((stop - start) /
+                                                      0.0174532925)) + 1)
+    everywhere = (slice(None), numpy.newaxis)
+    values = residual(grid, everywhere)
+    
+    ## Sign changes that are not poles of the BEMT lift coefficient
+    angle_of_rwind = local_pitch[everywhere] + grid
+    denominator = (numpy.sin(angle_of_rwind) +
+                   local_tsr[everywhere] * numpy.cos(angle_of_rwind))
+    brackets = ((numpy.sign(values[:, :-1]) != numpy.sign(values[:, 1:])) &
+                numpy.isfinite(values[:, :-1]) &
+                numpy.isfinite(values[:, 1:]) &
+                (numpy.sign(denominator[:, :-1]) ==
+                 numpy.sign(denominator[:, 1:])))
+    above = brackets & (grid[1:] > 0)
+    choice = numpy.where(above.any(axis=1), above.argmax(axis=1),
+                         len(grid) - 2 - brackets[:, ::-1].argmax(axis=1))
+    found = brackets.any(axis=1)
+    
+    rows = numpy.arange(len(fradius))
+    low, high = grid[choice], grid[choice + 1]
+    low_value, high_value = values[rows, choice], values[rows, choice + 1]
+    angle_of_attack = numpy.empty(len(fradius))
+    angle_of_attack.fill(numpy.nan)
+    side = numpy.zeros(len(fradius), dtype=int)
+    active = found.copy()
+    
+    ## Count the grid evaluations, so the iterations of both solvers are
+    ## numbers of lift coefficient differences evaluated
+    iterations = numpy.empty(len(fradius), dtype=int)
+    iterations.fill(len(grid))
+    for iteration in range(max_iterations):
+        if not active.any():
+            break
+        iterations[active] += 1
+        index = numpy.flatnonzero(active)
+        lo, hi = low[index], high[index]
+        lo_value, hi_value = low_value[index], high_value[index]
+        
+        ## False position, halving the value at an end kept twice
+        attack = (lo * hi_value - hi * lo_value) / (hi_value - lo_value)
+        value = residual(attack, index)
+        move_high = numpy.sign(value) == numpy.sign(hi_value)
+        lo_value = numpy.where(move_high & (side[index] == 1), lo_value / 2,
+                               lo_value)
+        hi_value = numpy.where(~move_high & (side[index] == -1),
+                               hi_value / 2, hi_value)
+        low[index] = numpy.where(move_high, lo, attack)
+        high[index] = numpy.where(move_high, attack, hi)
+        low_value[index] = numpy.where(move_high, lo_value, value)
+        high_value[index] = numpy.where(move_high, value, hi_value)
+        side[index] = numpy.where(move_high, 1, -1)
+        
+        done = ((abs(attack - angle_of_attack[index]) < tolerance) |
+                (value == 0) | (high[index] - low[index] < tolerance))
+        angle_of_attack[index] = attack
+        active[index] = ~done
+    
+    ## Station results at the solution
+    angle_of_rwind = local_pitch + angle_of_attack
+    local_tip_loss = tip_loss_array(number_blades, fradius, angle_of_rwind)
+    lift_coefficient = lift(angle_of_attack, bounds_error=False)
+    axial_induc_factor = calc_axial_factor(local_tip_loss, lift_coefficient,
+                                           angle_of_rwind, local_solidity)
+    angular_induc_factor = calc_angular_factor(axial_induc_factor,
+                                               angle_of_rwind, local_tsr)
+    drag_coefficient = drag(angle_of_attack, bounds_error=False)
+    
+    results = (local_tip_loss, angle_of_attack, angle_of_rwind,
+               lift_coefficient, drag_coefficient, axial_induc_factor,
+               angular_induc_factor)
+    return (tuple(result.reshape(shape) for result in results),
+            iterations.reshape(shape))
+
+
+def bemt_lift_coefficient(local_tip_loss, local_solidity, angle_of_rwind,
+                          local_tsr):
+    """Lift coefficient required by blade element momentum theory.
+
+    From 3.10.1.3 Manwell et. al.
+    """
+    return ((local_tip_loss / local_solidity) * 4 *
+            numpy.sin(angle_of_rwind) *
+            ((numpy.cos(angle_of_rwind) -
+              local_tsr * numpy.sin(angle_of_rwind)) /
+             (numpy.sin(angle_of_rwind) + local_tsr *
+              numpy.cos(angle_of_rwind))))
+
+
+class _Curve(object):
+    """Linear interpolation in a [[AoA, coef]..] curve, like interp1d."""
+    def __init__(self, curve):
+        curve = numpy.asarray(curve, dtype=float)
+        order = numpy.argsort(curve[:, 0])
+        self.angles, self.coefs = curve[order, 0], curve[order, 1]
+    
+    def __call__(self, angle_of_attack, bounds_error=True):
+        if bounds_error and (numpy.any(angle_of_attack < self.angles[0]) or
+                             numpy.any(angle_of_attack > self.angles[-1])):
+            raise ValueError("Angle of attack outside of the curve range")
+        return numpy.interp(angle_of_attack, self.angles, self.coefs,
+                            numpy.nan, numpy.nan)
+
+
+class AirfoilPolar(object):
+    """Lift and drag coefficients of an airfoil, tabulated for fast lookup.
+
+    The empirical curves are sorted and resampled once on a uniform grid of
+    angle of attack, so a lookup is an index calculation instead of a
+    search, for any array of angles. Build one polar and pass it as the
+    lift curve of the nonlinear methods to reuse it for all stations and
+    operating points.
+
+    Polars measured at several Reynolds numbers are interpolated linearly
+    between them. Their lookups need a Reynolds number, given to lift()
+    and drag() or fixed with at_reynolds().
+
+    INPUT
+    lift_curve: (array-like) [[AoA, lift_coef]..] points, or a list of
+                such curves, one per Reynolds number
+    drag_curve: (array-like) [[AoA, drag_coef]..] points, or a list
+    step:       (float) angle of attack step of the tables, by default the
+                smallest step of the curves (the tables then reproduce
+                curves given on a uniform grid exactly), but no finer
+                than the range over MAX_TABLE_POINTS
+    reynolds_numbers: (array-like) Reynolds number of each curve, if lists
+                      of curves are given
+    """
+    def __init__(self, lift_curve, drag_curve, step=None,
+                 reynolds_numbers=None):
+        if reynolds_numbers is None:
+            lift_curves, drag_curves = [lift_curve], [drag_curve]
+            self.reynolds_numbers = None
+        else:
+            if not len(lift_curve) == len(drag_curve) == \
+               len(reynolds_numbers):
+                raise ValueError("Need one lift and one drag curve per "
+                                 "Reynolds number")
+            order = numpy.argsort(reynolds_numbers)
+            lift_curves = [lift_curve[index] for index in order]
+            drag_curves = [drag_curve[index] for index in order]
+            self.reynolds_numbers = numpy.asarray(reynolds_numbers,
+                                                  dtype=float)[order]
+        self.reynolds = None
+        self.lift_table = _tabulate(lift_curves, step)
+        self.drag_table = _tabulate(drag_curves, step)
+        
+        ## Angles of attack covered by both tables
+        lift_start, lift_step, lift_values = self.lift_table
+        drag_start, drag_step, drag_values = self.drag_table
+        lift_stop = lift_start + lift_step * (lift_values.shape[1] - 1)
+        drag_stop = drag_start + drag_step * (drag_values.shape[1] - 1)
+        self.angle_range = (max(lift_start, drag_start),
+                            min(lift_stop, drag_stop))
+    
+    def at_reynolds(self, reynolds):
+        """Return a polar that looks up the curves at one Reynolds number."""
+        polar = copy.copy(self)
+        polar.reynolds = reynolds
+        return polar
+    
+    def lift(self, angle_of_attack, reynolds=None, bounds_error=True):
+        """Lift coefficient at angles of attack (radians, array-like)."""
+        return self._lookup(self.lift_table, angle_of_attack, reynolds,
+                            bounds_error)
+    
+    def drag(self, angle_of_attack, reynolds=None, bounds_error=True):
+        """Drag coefficient at angles of attack (radians, array-like)."""
+        return self._lookup(self.drag_table, angle_of_attack, reynolds,
+                            bounds_error)
+    
+    def _lookup(self, table, angle_of_attack, reynolds, bounds_error):
+        """Bilinear interpolation in a (start, step, values) table.
+
+        Angles outside of the table raise ValueError, or give NaN if not
+        bounds_error. Reynolds numbers are clipped to the measured range.
+        """
+        start, step, values = table
+        last = values.shape[1] - 1
+        
+        ## Plain arithmetic for the single angles of the scalar methods
+        if self.reynolds_numbers is None and numpy.ndim(angle_of_attack) == 0:
+            position = (float(angle_of_attack) - start) / step
+            if not -1e-9 < position < last + 1e-9:
+                if bounds_error:
+                    raise ValueError("Angle of attack outside of the polar "
+                                     "range")
+                return numpy.nan
+            index = min(max(int(position), 0), last - 1)
+            fraction = position - index
+            return (values[0, index] * (1 - fraction) +
+                    values[0, index + 1] * fraction)
+        
+        position = (numpy.asarray(angle_of_attack, dtype=float) -
+                    start) / step
+        with numpy.errstate(invalid='ignore'):
+            outside = ~((position > -1e-9) & (position < last + 1e-9))
+        if bounds_error and numpy.any(outside):
+            raise ValueError("Angle of attack outside of the polar range")
+        
+        position = numpy.where(outside, 0., position)
+        index = numpy.clip(numpy.floor(position).astype(int), 0, last - 1)
+        fraction = position - index
+        
+        if self.reynolds_numbers is None:
+            rows = values[0]
+            coefs = rows[index] * (1 - fraction) + rows[index + 1] * fraction
+        else:
+            if reynolds is None:
+                reynolds = self.reynolds
+            if reynolds is None:
+                raise ValueError("The polar needs a Reynolds number")
+            row = numpy.interp(reynolds, self.reynolds_numbers,
+                               numpy.arange(len(self.reynolds_numbers)))
+            row_index = numpy.clip(numpy.floor(row).astype(int), 0,
+                                   max(len(values) - 2, 0))
+            row_fraction = row - row_index
+            upper = numpy.minimum(row_index + 1, len(values) - 1)
+            coefs = ((values[row_index, index] * (1 - fraction) +
+                      values[row_index, index + 1] * fraction) *
+                     (1 - row_fraction) +
+                     (values[upper, index] * (1 - fraction) +
+                      values[upper, index + 1] * fraction) * row_fraction)
+        return numpy.where(outside, numpy.nan, coefs)
+
+
+## Largest number of angles of attack in an AirfoilPolar table
+MAX_TABLE_POINTS = 100000
+
+
+def _tabulate(curves, step=None):
+    """Resample [[AoA, coef]..] curves on one uniform angle of attack grid.
+
+    The grid covers the angles all curves have in common. The default step
+    is the smallest spacing of the curves, limited to MAX_TABLE_POINTS so
+    nearly equal angles do not blow the table up.
+    Output: (start, step, values), values is len(curves) x grid points
+    """
+    curves = [numpy.asarray(curve, dtype=float) for curve in curves]
+    curves = [curve[numpy.argsort(curve[:, 0])] for curve in curves]
+    start = max(curve[0, 0] for curve in curves)
+    stop = min(curve[-1, 0] for curve in curves)
+    if not stop > start:
+        raise ValueError("The curves have no common angle of attack range")
+    if step is None:
+        step = min(numpy.diff(curve[:, 0])[numpy.diff(curve[:, 0]) > 0].min()
+                   for curve in curves)
+        step = max(step, (stop - start) / (MAX_TABLE_POINTS - 1))
+    elif not step > 0:
+        raise ValueError("The angle of attack step must be positive")
+    elif (stop - start) / step + 1 > MAX_TABLE_POINTS + 1e-6:
+        raise ValueError("A step of %g gives more than %d table points"
+                         % (step, MAX_TABLE_POINTS))
+    
+    ## Adjust the step to put both ends on the grid
+    intervals = int(numpy.ceil((stop - start) / step - 1e-9))
+    angles = numpy.linspace(start, stop, intervals + 1)
+    values = numpy.array([numpy.interp(angles, curve[:, 0], curve[:, 1])
+                          for curve in curves])
+    return start, (stop - start) / intervals, values
+
         
 def optimum_rotor(lift_coefficient, angle_of_attack, tip_speed_ratio,
                   total_radius, hub_radius, number_blades, sections):
@@ -379,7 +926,8 @@ def optimum_rotor(lift_coefficient, angle_of_attack, tip_speed_ratio,
 
 
 def rotor_analysis(rct_matrix, tip_speed_ratio, number_blades, pitch_0,
-                   blade_radius, hub_radius, lift_curve, drag_curve, method):
+                   blade_radius, hub_radius, lift_curve, drag_curve, method,
+                   solver="step", cache=None):
     """Returns performance statistics of a rotor.
     
     INPUT
@@ -389,9 +937,13 @@ def rotor_analysis(rct_matrix, tip_speed_ratio, number_blades, pitch_0,
     blade_radius:          (float) radius in meters
     hub_radius:      (float) hub radius in meters
     lift_curve:       (array-like) either linear slope and intercept or
-                                  emperical C_l vs. AoA points
+                                  emperical C_l vs. AoA points, or an
+                                  AirfoilPolar for the nonlinear method
     drag_curve:       (array-like) either linear slope and intercept or
                                   emperical C_d vs. C_l points
+    solver:           (str) solver of the nonlinear method, 'step' or
+                            'bracket' (see nonlinear_method_factors())
+    cache:            (RotorCache) reuse results of identical calls
     
 
     
@@ -412,10 +964,18 @@ def rotor_analysis(rct_matrix, tip_speed_ratio, number_blades, pitch_0,
         local_power_coef: (float) local power coefficient
 
     """
+    if cache is not None:
+        key = cache.key('rotor_analysis', rct_matrix, tip_speed_ratio,
+                        number_blades, pitch_0, blade_radius, hub_radius,
+                        lift_curve, drag_curve, method, solver)
+    
     ## Convert all degrees to radians
     pitch_0, rct_matrix[:,2] = deg_rad("degrees", pitch_0, rct_matrix[:,2])
 
-
+    if cache is not None:
+        rotor_stats = cache.get(key)
+        if rotor_stats is not RotorCache.MISSING:
+            return rotor_stats
     
     rotor_stats = []
     ## Loop over each station
@@ -446,7 +1006,7 @@ def rotor_analysis(rct_matrix, tip_speed_ratio, number_blades, pitch_0,
                        nonlinear_method_factors(rct_matrix[j][0], number_blades,
                                                 local_pitch, local_tsr,
                                                 lift_curve, drag_curve,
-                                                local_solidity)
+                                                local_solidity, solver)
             
                 
         ## Calculate local thrust, torque, and power coefficients
@@ -468,8 +1028,328 @@ def rotor_analysis(rct_matrix, tip_speed_ratio, number_blades, pitch_0,
 
     ## Convert back to degrees
     
+    if cache is not None:
+        cache[key] = rotor_stats
     return rotor_stats
 
 
+def rotor_analysis_array(rct_matrix, tip_speed_ratio, number_blades, pitch_0,
+                         blade_radius, hub_radius, lift_curve, drag_curve,
+                         method, max_iterations=None, solver='step',
+                         tolerance=1e-6, return_iterations=False, cache=None):
+    """Returns performance statistics of a rotor, solving all stations at once.
+
+    Gives the results of rotor_analysis() as an array, iterating all blade
+    stations together (see linear_method_factors_array() and
+    nonlinear_method_factors_array()). rct_matrix is not changed.
+    tip_speed_ratio and pitch_0 may also be arrays, which are broadcast
+    against each other to evaluate many operating points in one call.
+
+    INPUT
+    As rotor_analysis()
+    max_iterations: (int) iteration guard of the method, its default if None
+    solver, tolerance: of the nonlinear method, see
+                       nonlinear_method_factors_array()
+    return_iterations: (boolean) also return the iterations of each station
+    cache: (RotorCache) reuse results of identical calls
+
+    OUTPUT
+    rotor_stats: (ndarray) n x 9, columns as the lists of rotor_analysis(),
+                 or broadcast(tip_speed_ratio, pitch_0).shape + (n, 9)
+    iterations: (int ndarray) n, or shaped as rotor_stats without the last
+                axis, only if return_iterations
+    """
+    if cache is not None:
+        key = cache.key('rotor_analysis_array', rct_matrix, tip_speed_ratio,
+                        number_blades, pitch_0, blade_radius, hub_radius,
+                        lift_curve, drag_curve, method, max_iterations,
+                        solver, tolerance, return_iterations)
+        rotor_stats = cache.get(key)
+        if rotor_stats is not RotorCache.MISSING:
+            return rotor_stats
+    
+    solution = _solve_rotor(rct_matrix, tip_speed_ratio, number_blades,
+                            pitch_0, blade_radius, lift_curve, drag_curve,
+                            method, max_iterations, solver=solver,
+                            tolerance=tolerance)
+    columns = numpy.broadcast_arrays(
+        solution['local_radius'], solution['tip_loss'],
+        solution['angle_of_attack'], solution['angle_of_rwind'],
+        solution['lift_coef'], solution['drag_coef'],
+        solution['axial_induc_factor'], solution['angular_induc_factor'],
+        solution['local_power_coef'])
+    rotor_stats = numpy.concatenate([column[..., numpy.newaxis]
+                                     for column in columns], axis=-1)
+    if return_iterations:
+        rotor_stats = rotor_stats, solution['iterations']
+    if cache is not None:
+        cache[key] = rotor_stats
+    return rotor_stats
+
+
+def _solve_rotor(rct_matrix, tip_speed_ratio, number_blades, pitch_0,
+                 blade_radius, lift_curve, drag_curve, method,
+                 max_iterations=None, bounds_error=True, solver='step',
+                 tolerance=1e-6):
+    """Station results of rotor_analysis_array() as a dictionary of arrays."""
+    rct_matrix = numpy.array(rct_matrix, dtype=float)
+    
+    ## Convert angles the same way as rotor_analysis()
+    pitch_0, twist = deg_rad("degrees", numpy.array(pitch_0, dtype=float),
+                             rct_matrix[:, 2])
+    
+    ## Operating points along the first axes, stations along the last
+    tip_speed_ratio = numpy.asarray(tip_speed_ratio,
+                                    dtype=float)[..., numpy.newaxis]
+    pitch_0 = numpy.asarray(pitch_0, dtype=float)[..., numpy.newaxis]
+    
+    ## Calculate method-independent station characteristics
+    fradius = rct_matrix[:, 0]
+    local_radius = fradius * blade_radius
+    local_tsr = tip_speed_ratio * fradius
+    local_solidity = number_blades * rct_matrix[:, 1] / (2 * numpy.pi *
+                                                         local_radius)
+    local_pitch = twist + pitch_0
+    
+    ## Calculate method dependent characteristics
+    options = {}
+    if max_iterations is not None:
+        options['max_iterations'] = max_iterations
+    if method == "linear":
+        factors = linear_method_factors_array(fradius, number_blades,
+                                              local_pitch, local_tsr,
+                                              lift_curve[0], lift_curve[1],
+                                              drag_curve[0], drag_curve[1],
+                                              local_solidity,
+                                              return_iterations=True,
+                                              **options)
+    else:
+        factors = nonlinear_method_factors_array(fradius, number_blades,
+                                                 local_pitch, local_tsr,
+                                                 lift_curve, drag_curve,
+                                                 local_solidity,
+                                                 bounds_error=bounds_error,
+                                                 solver=solver,
+                                                 tolerance=tolerance,
+                                                 return_iterations=True,
+                                                 **options)
+    solution = dict(zip(['tip_loss', 'angle_of_attack', 'angle_of_rwind',
+                         'lift_coef', 'drag_coef', 'axial_induc_factor',
+                         'angular_induc_factor', 'iterations'], factors))
+    
+    with numpy.errstate(all='ignore'):
+        local_thrust, local_torque, local_power_coef = \
+            rotor_coefs(solution['axial_induc_factor'],
+                        solution['angular_induc_factor'],
+                        solution['angle_of_rwind'], tip_speed_ratio,
+                        local_tsr, len(rct_matrix), local_solidity,
+                        solution['lift_coef'], solution['drag_coef'],
+                        solution['tip_loss'])
+    solution.update(fradius=fradius, local_radius=local_radius,
+                    local_thrust_coef=local_thrust,
+                    local_power_coef=local_power_coef)
+    return solution
+
+
+def performance_surface(rct_matrix, tip_speed_ratios, pitches, number_blades,
+                        blade_radius, hub_radius, lift_curve, drag_curve,
+                        method, processes=None, solver='step', cache=None):
+    """Rotor power, thrust and torque coefficients over a TSR x pitch grid.
+
+    All pitches of one tip speed ratio are solved in one call of the
+    array solver (see rotor_analysis_array()), tip speed ratios are spread
+    over a process pool. Grid points where the nonlinear method leaves
+    the lift or drag curve are NaN.
+
+    INPUT
+    rct_matrix, number_blades, blade_radius, hub_radius, lift_curve,
+    drag_curve, method: as rotor_analysis()
+    tip_speed_ratios: (array-like) tip speed ratios of the grid
+    pitches:          (array-like) pitch angles of the grid, as pitch_0 of
+                      rotor_analysis()
+    processes:        (int) number of workers, all cores by default,
+                      1 runs in this process
+    solver:           (str) solver of the nonlinear method, 'step' or
+                      'bracket' (see nonlinear_method_factors_array())
+    cache:            (RotorCache) reuse the surfaces of identical calls
+
+    OUTPUT
+    surfaces: (dict) of len(tip_speed_ratios) x len(pitches) arrays
+        power_coef:  (ndarray) rotor power coefficient Cp, the sum of the
+                     local power coefficients
+        thrust_coef: (ndarray) rotor thrust coefficient Ct, the local
+                     thrust coefficients weighted by annulus area
+        torque_coef: (ndarray) rotor torque coefficient Cq = Cp / TSR
+        and 'tip_speed_ratio' and 'pitch', the grid axes
+    """
+    tip_speed_ratios = numpy.atleast_1d(numpy.asarray(tip_speed_ratios,
+                                                      dtype=float))
+    pitches = numpy.atleast_1d(numpy.asarray(pitches, dtype=float))
+    if cache is not None:
+        key = cache.key('performance_surface', rct_matrix, tip_speed_ratios,
+                        pitches, number_blades, blade_radius, hub_radius,
+                        lift_curve, drag_curve, method, solver)
+        surfaces = cache.get(key)
+        if surfaces is not RotorCache.MISSING:
+            return surfaces
+    
+    tasks = [(rct_matrix, tip_speed_ratio, number_blades, pitches,
+              blade_radius, lift_curve, drag_curve, method, solver)
+             for tip_speed_ratio in tip_speed_ratios]
+    
+    rows = _pool_map(_surface_row, tasks, processes)
+    
+    power_coef = numpy.array([row[0] for row in rows])
+    surfaces = {'tip_speed_ratio': tip_speed_ratios, 'pitch': pitches,
+                'power_coef': power_coef,
+                'thrust_coef': numpy.array([row[1] for row in rows]),
+                'torque_coef': power_coef / tip_speed_ratios[:, numpy.newaxis]}
+    if cache is not None:
+        cache[key] = surfaces
+    return surfaces
+
+
+def _surface_row(task):
+    """Rotor Cp and Ct of all pitches at one tip speed ratio."""
+    (rct_matrix, tip_speed_ratio, number_blades, pitches, blade_radius,
+     lift_curve, drag_curve, method, solver) = task
+    solution = _solve_rotor(rct_matrix, tip_speed_ratio, number_blades,
+                            pitches, blade_radius, lift_curve, drag_curve,
+                            method, bounds_error=False, solver=solver)
+    number_stations = len(solution['fradius'])
+    
+    ## Annulus area of each station, 2 r dr / R**2 with dr = R / n
+    area = 2. * solution['fradius'] / number_stations
+    return (solution['local_power_coef'].sum(axis=-1),
+            (solution['local_thrust_coef'] * area).sum(axis=-1))
+
+
+class RotorCache(object):
+    """Bounded LRU cache of rotor analysis results.
+
+    Pass one cache as the cache argument of rotor_analysis(),
+    rotor_analysis_array() or performance_surface() to skip solving calls
+    made before with the same blade geometry, curves, method and operating
+    point. Keys are SHA-1 hashes of the arguments (see key()), values are
+    copied in and out so callers cannot change cached results.
+
+    INPUT
+    maxsize:   (int) number of results kept in memory, the least recently
+               used are dropped first, or None for no bound
+    directory: (str) optional directory that also keeps every result as a
+               pickle file, so results survive the process (not bounded)
+               and can be shared by processes, unreadable files are
+               misses
+    """
+    ## Returned by get() for keys without a result
+    MISSING = object()
+    
+    def __init__(self, maxsize=128, directory=None):
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("maxsize must be at least 1 or None")
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+    
+    def key(self, *arguments):
+        """SHA-1 hex digest of arguments (numbers, arrays, str, polars)."""
+        digest = hashlib.sha1()
+        for argument in arguments:
+            _hash_argument(digest, argument)
+        return digest.hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+    
+    def get(self, key):
+        """Copy of the result of key, or MISSING, counting a hit or a miss."""
+        if key in self._results:
+            result = self._results.pop(key)
+            self._results[key] = result
+        else:
+            result = self._load(key)
+            if result is self.MISSING:
+                self.misses += 1
+                return self.MISSING
+            self._store(key, result)
+        self.hits += 1
+        return copy.deepcopy(result)
+    
+    def _load(self, key):
+        """Result of key from the directory, MISSING if absent or broken."""
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return self.MISSING
+        try:
+            result_file = open(self._path(key), 'rb')
+            try:
+                return pickle.load(result_file)
+            finally:
+                result_file.close()
+        except (IOError, OSError, EOFError, ValueError,
+                pickle.UnpicklingError):
+            return self.MISSING
+    
+    def __setitem__(self, key, result):
+        self._store(key, copy.deepcopy(result))
+        if self.directory is not None:
+            ## Write a temporary file and rename it, so other processes
+            ## never read a partly written result
+            handle, temp_path = tempfile.mkstemp('.tmp', key, self.directory)
+            result_file = os.fdopen(handle, 'wb')
+            try:
+                pickle.dump(result, result_file, 2)
+            finally:
+                result_file.close()
+            try:
+                os.rename(temp_path, self._path(key))
+            except OSError:
+                ## Windows does not replace files, another process wrote
+                ## the same result first
+                os.remove(temp_path)
+    
+    def __len__(self):
+        return len(self._results)
+    
+    def _store(self, key, result):
+        self._results.pop(key, None)
+        self._results[key] = result
+        while self.maxsize is not None and len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+    
+    def clear(self):
+        """Drop the results in memory and reset the counters."""
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+    
+    def info(self):
+        """Dictionary of 'hits', 'misses', 'size' and 'maxsize'."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._results), 'maxsize': self.maxsize}
+
+
+def _hash_argument(digest, argument):
+    """Feed one argument of RotorCache.key() into a hashlib digest."""
+    if isinstance(argument, AirfoilPolar):
+        digest.update(b'AirfoilPolar')
+        for start, step, values in (argument.lift_table,
+                                    argument.drag_table):
+            for value in (start, step, values):
+                _hash_argument(digest, value)
+        _hash_argument(digest, argument.reynolds_numbers)
+        _hash_argument(digest, argument.reynolds)
+    elif argument is None or isinstance(argument, str):
+        digest.update(repr(argument).encode('utf-8'))
+    else:
+        ## Numbers and arrays by value, so 7 and 7.0 give the same key
+        array = numpy.asarray(argument, dtype=float)
+        digest.update(repr(array.shape).encode('utf-8'))
+        digest.update(numpy.ascontiguousarray(array).data)
+
+
 ## For Testing
 ## rotor_analysis([[.2,2.,.3],[.4,2.,.4],[.6,2.,.5],[.8,2.,.6],[.9,2,.6],[.9,2.,.6]], 10., 3, .1, 10., 1., [[0.,0.],[1.,30],[1.5,40]],[[0.,0.],[1.,30],[1.5,40]], "nonlinear")
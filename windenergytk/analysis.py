@@ -33,11 +33,96 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
 ################################################################################
 
-from numpy import histogram
-from numpy import mean as npmean
-import scikits.timeseries as ts
-from scipy.special import gamma
-from matplotlib.pyplot import psd
+from numpy import add, arange, asarray, bincount, clip, concatenate, diff, dot
+from numpy import flatnonzero, floor, histogram, inf, linspace, maximum
+from numpy import minimum, newaxis, ones, repeat, seterr, sqrt, where, zeros
+from numpy.ma import getdata, getmaskarray
+import numpy.ma
+from numpy.fft import rfft, irfft
+
+## scipy and scikits.timeseries are imported by the functions that need them
+## so that importing this module stays cheap for short lived scripts.
+
+
+class StatisticsAccumulator(object):
+    """
+    Mergeable running statistics of a timeseries fed in chunks.
+
+    Chunks are reduced with numpy and folded into a running count, mean
+    and sum of squared deviations (Chan et al. pairwise update), so the
+    full series never has to be held in memory. Accumulators filled on
+    separate chunks or workers can be combined with merge().
+    Masked values are left out of every statistic except 'size'.
+    """
+    def __init__(self):
+        self.count = 0
+        self.size = 0
+        self.mean = 0.
+        self.sum_squares = 0.
+        self.max = None
+        self.min = None
+
+    def add(self, chunk):
+        """
+        Fold a chunk of values into the statistics.
+        Input: timeseries, masked array or array-like chunk
+        Output: the accumulator itself
+        """
+        chunk = numpy.ma.asarray(chunk)
+        values = chunk.compressed()
+        self.size += chunk.size
+        if values.size:
+            chunk_mean = values.mean()
+            self._combine(values.size, chunk_mean,
+                          ((values - chunk_mean) ** 2).sum(),
+                          values.max(), values.min())
+        return self
+
+    def merge(self, other):
+        """
+        Fold the statistics of another accumulator into this one.
+        Input: StatisticsAccumulator
+        Output: the accumulator itself
+        """
+        self.size += other.size
+        if other.count:
+            self._combine(other.count, other.mean, other.sum_squares,
+                          other.max, other.min)
+        return self
+
+    def _combine(self, count, mean, sum_squares, chunk_max, chunk_min):
+        """Pairwise update of count, mean and squared deviations."""
+        total = self.count + count
+        delta = mean - self.mean
+        self.sum_squares += (sum_squares +
+                             delta ** 2 * self.count * count / float(total))
+        self.mean += delta * count / float(total)
+        self.count = total
+        if self.count == count:
+            self.max, self.min = chunk_max, chunk_min
+        else:
+            self.max = max(self.max, chunk_max)
+            self.min = min(self.min, chunk_min)
+
+    def get_statistics(self, output='dictionary'):
+        """
+        Finalize statistics in the same format as get_statistics().
+        Input: output format ('dictionary' or 'list')
+        Output: Dictionary or array of mean, stdev, max, min, size
+                Without any valid value mean, stdev, max and min are
+                numpy.ma.masked, as masked array reductions return.
+        """
+        stat_names = ['mean', 'std', 'max', 'min', 'size']
+        if self.count:
+            stat_values = [self.mean, (self.sum_squares / self.count) ** .5,
+                           self.max, self.min, self.size]
+        else:
+            stat_values = [numpy.ma.masked] * 4 + [self.size]
+
+        if output == 'list':
+            return stat_values
+        else:
+            return dict(zip(stat_names, stat_values))
 
 
 def get_statistics(timeseries, output='dictionary'):
@@ -46,18 +131,9 @@ def get_statistics(timeseries, output='dictionary'):
     
     Input: A timeseries object, output format ('dictionary' or 'list')
     Output: Dictionary or array of mean, stdev, max, min, size
+            (masked if the timeseries has no valid value)
     """
-    stat_names = ['mean', 'std', 'max', 'min', 'size']
-    stat_values = [timeseries.mean(), timeseries.std(),
-    timeseries.max(), timeseries.min(),timeseries.size]
-    
-    if output == 'list':
-        return stat_values
-    else:
-        tsdict = {}
-        for index in range(5):
-            tsdict[stat_names[index]] = stat_values[index]
-        return tsdict
+    return StatisticsAccumulator().add(timeseries).get_statistics(output)
 
 def get_histogram_data(timeseries, bins=10, normalized=True):
     """
@@ -74,6 +150,7 @@ def get_weibull_params(mean, stdev):
     Input: mean, stdev
     Output: Weibull scale: c, shape: k
     Citation: Manwell 2000, chapter 2"""
+    from scipy.special import gamma
     if mean > 0:
         k = (stdev / mean)**-1.086
         c =  mean / gamma(1 + 1 / k)
@@ -82,93 +159,310 @@ def get_weibull_params(mean, stdev):
     return c, k
 
 
-def crosscorrelate(timeseries1, timeseries2, max_lag_increment=False):
+def get_bulk_statistics(data_array, bins=10, normalized=True):
+    """
+    Collects statistics of every sensor (column) of a 2-D array at once.
+
+    Input: 2-D (masked) array or timeseries of time x sensors,
+           as returned by file_ops.parse_data()
+    Optional: No. of bins (default is 10), normalized (boolean)
+    Output: Dictionary of arrays with one value per sensor:
+            mean, std, max, min, size, count (unmasked values),
+            histogram (sensors x bins), bin_edges (sensors x bins+1),
+            weibull_c, weibull_k, turbulence_intensity
+            Statistics of sensors without any valid value are masked.
+    """
+    from scipy.special import gamma
+    valid = ~getmaskarray(data_array)
+    values = asarray(getdata(data_array), dtype=float)
+    size = values.shape[0]
+    count = valid.sum(axis=0)
+    empty = count == 0
+
+    err = seterr(divide='ignore', invalid='ignore')
+    try:
+        ## Moments of the unmasked values
+        mean = where(valid, values, 0.).sum(axis=0) / count
+        deviations = where(valid, values - mean, 0.)
+        std = sqrt((deviations ** 2).sum(axis=0) / count)
+        max_values = where(valid, values, -inf).max(axis=0)
+        min_values = where(valid, values, inf).min(axis=0)
+
+        ## Histograms: equal width bins between each sensor's min and max,
+        ## the last bin includes its right edge as in numpy.histogram
+        low = where(empty, 0., min_values)
+        high = where(empty, 1., max_values)
+        flat = high == low
+        low, high = where(flat, low - .5, low), where(flat, high + .5, high)
+        bin_edges = low[:, newaxis] + (high - low)[:, newaxis] * \
+                    linspace(0., 1., bins + 1)
+        bin_index = floor((values - low) / (high - low) * bins)
+        bin_index = clip(bin_index, 0, bins - 1).astype(int)
+        bin_index += arange(values.shape[1]) * bins
+        hist = bincount(bin_index[valid], minlength=values.shape[1] * bins)
+        hist = hist.reshape(values.shape[1], bins)
+        if normalized:
+            hist = hist / (count[:, newaxis] * diff(bin_edges, axis=1))
+
+        ## Weibull parameters and turbulence intensity
+        positive = mean > 0
+        weibull_k = where(positive, (std / mean) ** -1.086, 0.)
+        weibull_c = where(positive, mean / gamma(1 + 1 / weibull_k), 0.)
+        turbulence_intensity = where(positive, std / mean, 0.)
+    finally:
+        seterr(**err)
+
+    bulk_stats = {'mean': mean, 'std': std, 'max': max_values,
+                  'min': min_values, 'weibull_c': weibull_c,
+                  'weibull_k': weibull_k,
+                  'turbulence_intensity': turbulence_intensity}
+    for key, value in bulk_stats.items():
+        bulk_stats[key] = numpy.ma.masked_where(empty, value)
+    bulk_stats['size'] = size
+    bulk_stats['count'] = count
+    bulk_stats['histogram'] = hist
+    bulk_stats['bin_edges'] = bin_edges
+    return bulk_stats
+
+
+def crosscorrelate(timeseries1, timeseries2, max_lag_increment=False,
+                   method='fft'):
     """
     Returns crosscorrelation values at lag increments.
     Input: timeseries1, timeseries2
-    Optional: max_lag_increment (int)
+    Optional: max_lag_increment (int), method ('fft' or 'direct')
     Output: array of lags, array of correlation values
+
+    The 'fft' method computes every lag at once from the zero padded
+    spectra of both series. The 'direct' method sums the lagged products
+    one lag at a time and is kept as a reference implementation.
+    Masked values are left out: each lag is normalized by its number of
+    pairs of valid values, and with masked input the correlation values
+    are a masked array, masked at lags without any valid pair.
     """
-    # If no max_lag_increment, do it for the length of timeseries
-    if len(timeseries1) < len(timeseries2):
-        smaller = timeseries1
+    # Only the overlapping part of the two timeseries is compared
+    length = min(len(timeseries1), len(timeseries2))
+    # If no max_lag_increment, do it for the length of timeseries.
+    # A lag of length or more leaves no samples to compare.
+    if not max_lag_increment or max_lag_increment > length - 1:
+        max_lag_increment = length - 1
+
+    # Subtract mean from timeseries values, save as new arrays with
+    # masked values set to zero so they add nothing to the lagged sums
+    std1, std2 = timeseries1.std(), timeseries2.std()
+    difference_from_mean1 = asarray(numpy.ma.filled(
+        timeseries1 - timeseries1.mean(), 0.), dtype=float)[:length]
+    difference_from_mean2 = asarray(numpy.ma.filled(
+        timeseries2 - timeseries2.mean(), 0.), dtype=float)[:length]
+    valid1 = ~getmaskarray(timeseries1)[:length]
+    valid2 = ~getmaskarray(timeseries2)[:length]
+
+    if method == 'direct':
+        lagged_sums_function = _direct_lagged_sums
+    elif method == 'fft':
+        lagged_sums_function = _fft_lagged_sums
     else:
-        smaller = timeseries2
-    if not max_lag_increment:
-        max_lag_increment=len(smaller)
-        
-    # Create empty arrays, calculate means, std
-    lag_values = []
-    crosscorrelation_values = []
-    difference_from_mean1, difference_from_mean2 = [],[]
-    mean1,mean2 = timeseries1.mean(),timeseries2.mean()
-    std1,std2 = timeseries1.std(),timeseries2.std()
-
-    # Subtract mean from timeseries values, save as new arrays
-    for array, timeseries, mean in [(difference_from_mean1, timeseries1, mean1),
-                                    (difference_from_mean2,timeseries2, mean2)]:
-        for value in timeseries:
-            array.append(value-mean)
-
-    # Do comparison at different lags
-    for lag in range(0, max_lag_increment+1):
-        mysum = 0
-        for timestep in range(0,len(smaller)-lag):
-            mysum += (difference_from_mean1[timestep] * \
-            difference_from_mean2[timestep+lag])
-            normalized_value = mysum / ((std1*std2)*(len(smaller)-lag))
-        lag_values.append(lag)
-        crosscorrelation_values.append(normalized_value)
-    return lag_values, crosscorrelation_values
-
-def autocorrelate(timeseries, max_lag_increment=False):
+        raise ValueError("Unknown correlation method: %s" % method)
+    lagged_sums = lagged_sums_function(difference_from_mean1,
+                                       difference_from_mean2,
+                                       max_lag_increment)
+
+    # Normalize by the standard deviations and number of compared values
+    lag_values = arange(max_lag_increment + 1)
+    if valid1.all() and valid2.all():
+        return lag_values, lagged_sums / ((std1 * std2) *
+                                          (length - lag_values))
+
+    # Lagged sums of the validity masks count the pairs of valid values
+    pair_counts = floor(lagged_sums_function(asarray(valid1, dtype=float),
+                                             asarray(valid2, dtype=float),
+                                             max_lag_increment) + 0.5)
+    crosscorrelation_values = lagged_sums / ((std1 * std2) *
+                                             where(pair_counts > 0,
+                                                   pair_counts, 1))
+    return lag_values, numpy.ma.masked_where(pair_counts == 0,
+                                             crosscorrelation_values)
+
+def _direct_lagged_sums(values1, values2, max_lag_increment):
+    """Sum of values1[t] * values2[t + lag] for each lag, one lag at a time."""
+    length = len(values1)
+    lagged_sums = zeros(max_lag_increment + 1)
+    for lag in range(0, max_lag_increment + 1):
+        lagged_sums[lag] = dot(values1[:length - lag], values2[lag:])
+    return lagged_sums
+
+def _fft_lagged_sums(values1, values2, max_lag_increment):
+    """Sum of values1[t] * values2[t + lag] for each lag, using the FFT."""
+    length = len(values1)
+    # Zero pad to a power of two of at least 2n - 1 points so the circular
+    # correlation of the spectra does not wrap around
+    fft_size = 1
+    while fft_size < 2 * length - 1:
+        fft_size *= 2
+    spectrum1 = rfft(values1, fft_size)
+    spectrum2 = rfft(values2, fft_size)
+    return irfft(spectrum1.conjugate() * spectrum2,
+                 fft_size)[:max_lag_increment + 1]
+
+def autocorrelate(timeseries, max_lag_increment=False, method='fft'):
     """
     Returns autocorrelation values at lag increments.
     Input: a single timeseries object
-    optional: max_lag_increment
+    optional: max_lag_increment, method ('fft' or 'direct')
     Output: Array of lags, Array of normalized autocorrelation values.
     """
-    return crosscorrelate(timeseries, timeseries, max_lag_increment)
+    return crosscorrelate(timeseries, timeseries, max_lag_increment, method)
 
-def block_average(timeseries, new_freq=''):
+def block_statistics(timeseries, new_freq=''):
     """
-    Reduce size of timeseries by taking averages of larger block size.
+    Collect mean, count, min, max and std of each block of a new frequency.
     Input: timeseries, new_freq (str) See scikits.timeseries doc
-    Output: block averaged timeseries obj. in new frequency
+    Output: Dictionary of timeseries obj. in new frequency with keys
+            'mean', 'count', 'min', 'max', 'std'
+            Blocks without valid values are left out of the output, so
+            empty or fully masked input gives empty timeseries.
     """
+    import scikits.timeseries as ts
     # Label timeseries data with new frequency
     # ie: [5.5, 4.5] | [13-May-2009 11:40 13-May-2009 11:50] becomes
     #     [5.5, 4.5] | [13-May-2009 13-May-2009]
     timeseries = timeseries.asfreq(new_freq)
 
-    # Create empty arrays, set first block_time
-    current_block_values = []
-    averages = []
-    timesteps = []
-    current_block_time = timeseries.dates[0]
-
-    # For each index in timeseries, if the block of time has changed,
-    # average the previous block values.  Otherwise keep adding
-    # values to be averaged.
-    for index in range(0,len(timeseries)):
-        if current_block_time != timeseries.dates[index]:
-            averages.append(npmean(current_block_values))
-            timesteps.append(current_block_time)
-            current_block_values = []
-            current_block_time = timeseries.dates[index]
-        current_block_values.append(timeseries[index])
-    # Take average for last (or only) time block
-    if current_block_values:
-        averages.append(npmean(current_block_values))
-        timesteps.append(current_block_time)
-        
-
-    # Return new block averages and timesteps as timeseries object
-    return ts.time_series(averages,dates=timesteps)
-
-
-def power_spectral_density(data_array, frequency, segment_size=256, window_method=False):
-    """Return the power spectral density using matplotlib.pyplot.psd function."""
-    return psd(data_array, NFFT=segment_size, Fs = frequency)
+    # Leave masked values out of every block
+    valid = ~getmaskarray(timeseries)
+    values = asarray(getdata(timeseries), dtype=float)[valid]
+    dates = timeseries.dates[valid]
+    if not len(values):
+        empty = dates[:0]
+        return dict((key, ts.time_series(zeros(0), dates=empty))
+                    for key in ('mean', 'count', 'min', 'max', 'std'))
+
+    # A new block starts wherever the date label changes
+    date_values = asarray(dates.tovalue())
+    block_starts = concatenate(([0], flatnonzero(diff(date_values)) + 1))
+
+    # Reduce every block at once
+    counts = diff(concatenate((block_starts, [len(values)])))
+    means = add.reduceat(values, block_starts) / counts
+    deviations = values - repeat(means, counts)
+    stds = sqrt(add.reduceat(deviations ** 2, block_starts) / counts)
+    block_stats = {'mean': means,
+                   'count': counts,
+                   'min': minimum.reduceat(values, block_starts),
+                   'max': maximum.reduceat(values, block_starts),
+                   'std': stds}
+
+    # Return block statistics and timesteps as timeseries objects
+    timesteps = dates[block_starts]
+    for key, value in block_stats.items():
+        block_stats[key] = ts.time_series(value, dates=timesteps)
+    return block_stats
+
+def block_average(timeseries, new_freq=''):
+    """
+    Reduce size of timeseries by taking averages of larger block size.
+    Input: timeseries, new_freq (str) See scikits.timeseries doc
+    Output: block averaged timeseries obj. in new frequency
+    """
+    return block_statistics(timeseries, new_freq)['mean']
+
 
+def welch_psd(data_array, frequency, segment_size=256, window='hanning',
+              overlap=0, detrend='none'):
+    """
+    Estimate the power spectral density with Welch's averaged periodogram.
+    Input: data_array, sampling frequency
+    Optional: segment_size (int), window ('hanning', 'hamming', 'bartlett',
+              'blackman', 'none' or array of segment_size weights),
+              overlap (int, points shared by neighbouring segments),
+              detrend ('none', 'mean' or 'linear', applied per segment)
+    Output: array of frequencies, array of one sided power spectral density
 
+    Series shorter than segment_size are zero padded to one segment.
+    Scaling follows matplotlib.mlab.psd, so the density integrates to the
+    variance of the windowed data.
+    """
+    data_array = asarray(data_array, dtype=float)
+    if len(data_array) < segment_size:
+        data_array = concatenate((data_array,
+                                  zeros(segment_size - len(data_array))))
+
+    ## Window weights
+    if isinstance(window, str):
+        if window == 'none':
+            weights = ones(segment_size)
+        elif window in ('hanning', 'hamming', 'bartlett', 'blackman'):
+            weights = getattr(numpy, window)(segment_size)
+        else:
+            raise ValueError("Unknown window: %s" % window)
+    else:
+        weights = asarray(window, dtype=float)
+        if len(weights) != segment_size:
+            raise ValueError("Window length must equal segment_size")
+
+    ## Overlapping segments as rows of a 2-D array
+    step = segment_size - overlap
+    if step < 1:
+        raise ValueError("overlap must be smaller than segment_size")
+    starts = arange(0, len(data_array) - segment_size + 1, step)
+    segments = data_array[starts[:, newaxis] + arange(segment_size)]
+
+    ## Detrend each segment
+    if detrend == 'mean':
+        segments = segments - segments.mean(axis=1)[:, newaxis]
+    elif detrend == 'linear':
+        time = arange(segment_size) - (segment_size - 1) / 2.
+        slopes = dot(segments, time) / dot(time, time)
+        segments = segments - segments.mean(axis=1)[:, newaxis] - \
+                   slopes[:, newaxis] * time
+    elif detrend != 'none':
+        raise ValueError("Unknown detrend method: %s" % detrend)
+
+    ## Average the periodograms of all segments
+    spectra = rfft(segments * weights, axis=1)
+    pxx = (spectra.real ** 2 + spectra.imag ** 2).mean(axis=0)
+    pxx /= frequency * (weights ** 2).sum()
+    ## Fold negative frequencies onto positive ones, except DC and Nyquist
+    if segment_size % 2:
+        pxx[1:] *= 2
+    else:
+        pxx[1:-1] *= 2
+    freqs = arange(len(pxx)) * float(frequency) / segment_size
+    return freqs, pxx
+
+def power_spectral_density(data_array, frequency, segment_size=256,
+                           window_method=False, overlap=0, detrend='none'):
+    """
+    Return the power spectral density with the same output as
+    matplotlib.pyplot.psd, without drawing anything.
+    Input: data_array, sampling frequency
+    Optional: segment_size (int), window_method (see welch_psd, default is
+              'hanning'), overlap (int), detrend (str)
+    Output: array of power spectral density, array of frequencies
+    """
+    if window_method is False:
+        window_method = 'hanning'
+    freqs, pxx = welch_psd(data_array, frequency, segment_size,
+                           window_method, overlap, detrend)
+    return pxx, freqs
+
+
+def _pool_map(function, tasks, processes=None, chunksize=None):
+    """
+    Map function over tasks on a process pool, in order.
+    Input: picklable module level function, list of tasks
+    Optional: processes (int) number of workers, all cores by default,
+              1 runs in this process, chunksize (int) passed to Pool.map
+    Output: list of results
+    """
+    if processes == 1:
+        return [function(task) for task in tasks]
+    
+    import multiprocessing
+    
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(function, tasks, chunksize)
+    finally:
+        pool.close()
+        pool.join()
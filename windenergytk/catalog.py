@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+################################################################################
+# catalog.py                                                                   #
+#                                                                              #
+# Part of UMass Amherst's Wind Energy Engineering Toolbox of Mini-Codes        #
+#                   (or Mini-Codes for short)                                  #
+#                                                                              #
+# Python code by Alec Koumjian  -   akoumjian@gmail.com                        #
+#                                                                              #
+# This code adapted from the original Visual Basic code at                     #
+# http://www.ceere.org/rerl/projects/software/mini-code-overview.html          #
+#                                                                              #
+# These tools can be used in conjunction with the textbook                     #
+# "Wind Energy Explained" by J.F. Manwell, J.G. McGowan and A.L. Rogers        #
+# http://www.ceere.org/rerl/rerl_windenergytext.html                           #
+#                                                                              #
+################################################################################
+#   Copyright 2009 Alec Koumjian                                               #
+#                                                                              #
+#   This program is free software: you can redistribute it and/or modify       #
+#   it under the terms of the GNU General Public License as published by       #
+#   the Free Software Foundation, either version 3 of the License, or          #
+#   (at your option) any later version.                                        #
+#                                                                              #
+#    This program is distributed in the hope that it will be useful,           #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#    GNU General Public License for more details.                              #
+#                                                                              #
+#    You should have received a copy of the GNU General Public License         #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+################################################################################
+
+import os
+import sqlite3
+
+from windenergytk import file_ops
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    size INTEGER,
+    mtime REAL,
+    site_name TEXT,
+    location TEXT,
+    latitude REAL,
+    longitude REAL,
+    time_step INTEGER,
+    start_date TEXT,
+    end_date TEXT
+);
+CREATE TABLE IF NOT EXISTS sensors (
+    file_id INTEGER REFERENCES files(id) ON DELETE CASCADE,
+    number INTEGER,
+    name TEXT,
+    type TEXT,
+    designation TEXT,
+    height REAL,
+    units TEXT
+);
+CREATE INDEX IF NOT EXISTS sensors_file ON sensors (file_id);
+CREATE INDEX IF NOT EXISTS files_site ON files (site_name, start_date);
+"""
+
+
+def open_catalog(db_path):
+    """Open (and create if needed) a catalog of dat file headers.
+
+    INPUT
+    db_path: (str) path of the SQLite database, ':memory:' for a
+             temporary catalog
+
+    OUTPUT
+    connection: (sqlite3.Connection)
+    """
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def refresh_catalog(connection, paths):
+    """Add new and changed dat files to the catalog, drop vanished ones.
+
+    Only the headers of new files and of files whose size or modification
+    time changed are read, with file_ops.parse_meta().
+
+    INPUT
+    connection: (sqlite3.Connection) from open_catalog()
+    paths: directory, glob pattern or list of dat files
+           (see file_ops.find_files)
+
+    OUTPUT
+    changes: (dict) number of 'added', 'updated', 'removed' and
+             'unchanged' files, and 'errors', a list of (path, message)
+    """
+    changes = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0,
+               'errors': []}
+    known = dict((path, (size, mtime)) for path, size, mtime in
+                 connection.execute("SELECT path, size, mtime FROM files"))
+    
+    for path in file_ops.find_files(paths):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if known.get(path) == (stat.st_size, stat.st_mtime):
+            changes['unchanged'] += 1
+            continue
+        try:
+            dat_file = file_ops.open_dat(path, background=False)
+            try:
+                meta_dict = file_ops.parse_meta(file_ops.read_header(dat_file))
+            finally:
+                dat_file.close()
+        except (IOError, EOFError, ValueError) as error:
+            changes['errors'].append((path, str(error)))
+            continue
+        
+        if path in known:
+            connection.execute("DELETE FROM files WHERE path = ?", (path,))
+            changes['updated'] += 1
+        else:
+            changes['added'] += 1
+        _add_file(connection, path, stat, meta_dict)
+    
+    ## Drop files that no longer exist
+    for path in known:
+        if not os.path.exists(path):
+            connection.execute("DELETE FROM files WHERE path = ?", (path,))
+            changes['removed'] += 1
+    
+    connection.commit()
+    return changes
+
+
+def _add_file(connection, path, stat, meta_dict):
+    """Insert one file and its sensors into the catalog."""
+    start_date, end_date = parse_time_period(meta_dict['time_period'])
+    time_step = meta_dict['time_step']
+    if not isinstance(time_step, int):
+        time_step = None
+    cursor = connection.execute(
+        "INSERT INTO files (path, size, mtime, site_name, location, "
+        "latitude, longitude, time_step, start_date, end_date) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (path, stat.st_size, stat.st_mtime, _text(meta_dict['site_name']),
+         _text(meta_dict['location']),
+         meta_dict['coords'].get('latitude'),
+         meta_dict['coords'].get('longitude'),
+         time_step, start_date, end_date))
+    
+    for number, sensor in sorted(meta_dict['sensors'].items()):
+        connection.execute(
+            "INSERT INTO sensors (file_id, number, name, type, designation, "
+            "height, units) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (cursor.lastrowid, number, _text(sensor.get('name')),
+             _text(sensor.get('type')), _text(sensor.get('designation')),
+             _number(sensor.get('meters_above_ground')),
+             _text(sensor.get('units'))))
+
+
+def _text(value):
+    """Store meta values as text, missing values (False) as NULL."""
+    if value is False or value is None:
+        return None
+    return str(value)
+
+
+def _number(value):
+    """Store meta values as floats, missing or non-numeric ones as NULL.
+
+    sanitize() only converts integers, so '39.5' is still a string here.
+    """
+    if value is False or value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_time_period(time_period):
+    """Split a report time period into start and end date strings.
+
+    INPUT
+    time_period: (str) e.g. '2006-01-01 to 2006-04-03 09:50:00'
+
+    OUTPUT
+    start_date: (str) 'YYYY-MM-DD HH:MM:SS' or None
+    end_date: (str) 'YYYY-MM-DD HH:MM:SS' or None, a date without time
+              is taken to the end of that day
+    """
+    if not time_period or ' to ' not in str(time_period):
+        return None, None
+    start, end = [part.strip() for part in str(time_period).split(' to ')]
+    return _full_date(start, '00:00:00'), _full_date(end, '23:59:59')
+
+
+def _full_date(text, default_time):
+    """Complete 'YYYY-MM-DD[ HH:MM[:SS]]' to 'YYYY-MM-DD HH:MM:SS'."""
+    if ' ' not in text:
+        return "%s %s" % (text, default_time)
+    day, time = text.split(' ', 1)
+    if time.count(':') == 1:
+        time += ':00'
+    return "%s %s" % (day, time)
+
+
+def find_sensors(connection, site_name=None, name=None, sensor_type=None,
+                 height=None, start_date=None, end_date=None):
+    """Find files and sensor columns matching a query, from the catalog.
+
+    All given criteria must match. Text is compared in lower case, as
+    stored by file_ops.parse_meta().
+
+    INPUT
+    connection: (sqlite3.Connection) from open_catalog()
+    site_name: (str) site name
+    name: (str) sensor name, e.g. 'anem39ams'
+    sensor_type: (str) sensor type, e.g. 'anemometer'
+    height: (float) height above ground in meters
+    start_date, end_date: (str) 'YYYY-MM-DD[ HH:MM:SS]', files whose time
+                          period overlaps these dates
+
+    OUTPUT
+    handles: (list) of (path, sensor_number) tuples, sensor_number is the
+             key of the sensor in file_ops.parse_file() output
+    """
+    query = ("SELECT files.path, sensors.number FROM sensors "
+             "JOIN files ON files.id = sensors.file_id WHERE 1")
+    parameters = []
+    for column, value in (('files.site_name', site_name),
+                          ('sensors.name', name),
+                          ('sensors.type', sensor_type)):
+        if value is not None:
+            query += " AND %s = ?" % column
+            parameters.append(str(value).strip().lower())
+    if height is not None:
+        query += " AND sensors.height = ?"
+        parameters.append(float(height))
+    if start_date is not None:
+        query += " AND files.end_date >= ?"
+        parameters.append(_full_date(start_date, '00:00:00'))
+    if end_date is not None:
+        query += " AND files.start_date <= ?"
+        parameters.append(_full_date(end_date, '23:59:59'))
+    query += " ORDER BY files.start_date, files.path, sensors.number"
+    return [(path, number) for path, number in
+            connection.execute(query, parameters)]
@@ -33,9 +33,39 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
 ################################################################################
 
-from scikits.timeseries import tsfromtxt as tsfromtxt
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+from datetime import datetime
+import glob
+import io
+import os
+import pickle
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 import numpy.ma
 
+from windenergytk.analysis import StatisticsAccumulator, _pool_map
+
+## scikits.timeseries is imported by the functions that build timeseries.
+
+## Suffix of the binary cache directory written next to a dat file
+CACHE_SUFFIX = '.cache'
+
+## Leading bytes, module and file class of the supported compressions
+COMPRESSIONS = [(b'\x1f\x8b', 'gzip', 'GzipFile'),
+                (b'BZh', 'bz2', 'BZ2File'),
+                (b'\xfd7zXZ\x00', 'lzma', 'LZMAFile')]
+
+## File name patterns of (compressed) dat files
+DAT_PATTERNS = ['*.dat', '*.dat.gz', '*.dat.bz2', '*.dat.xz']
+
 
 def sanitize(a_string):
     """
@@ -54,52 +84,697 @@ def sanitize(a_string):
 
 
 
-def parse_file(dat_file):
+def parse_file(dat_file, lazy=False):
     """Return meta and timeseries objects from WEC dat file.
 
-    Input: opened WEC data file
+    The whole text file is parsed either way. lazy=True only defers
+    splitting the columns into sensor timeseries and saves no parse time
+    on its own; use parse_path() with its binary cache to read only the
+    columns used from disk.
+
+    Input: opened WEC data file, or path of a (compressed) WEC data file
+    Optional: lazy (boolean) return SensorEntry objects (see lazy_meta)
+    Output: Dictionary of timeseries with meta-data attached
+    """
+    meta_dict, timeseries = parse_data(dat_file)
+    return _meta_ts_dict(meta_dict, timeseries, lazy)
+
+
+def _meta_ts_dict(meta_dict, timeseries, lazy=False):
+    """Separate a 2-D timeseries and attach meta and data recovery."""
+    if lazy:
+        return lazy_meta(meta_dict, timeseries)
+    
+    ## Separate timeseries
+    ts_dict = separate_timeseries(timeseries)
+    
+    ## Assign meta data to ts data
+    meta_ts_dict = assign_meta(ts_dict, meta_dict)
+    
+    ## Add data recovery from the mask of the whole array
+    valid_counts, recovery_rates = data_recovery(timeseries)
+    for index in range(len(valid_counts)):
+        meta_ts_dict[index + 1]['valid_count'] = valid_counts[index]
+        meta_ts_dict[index + 1]['data_recovery'] = recovery_rates[index]
+    
+    return meta_ts_dict
+    
+    
+def parse_data(dat_file):
+    """Return meta dictionary and multi column timeseries from WEC dat file.
+
+    Input: opened WEC data file, or path of a (compressed) WEC data file
+    Output: meta dictionary from parse_meta(),
+            2-D timeseries (time x sensors) with filter values masked
+    """
+    if isinstance(dat_file, str):
+        dat_file = open_dat(dat_file)
+        try:
+            return parse_data(dat_file)
+        finally:
+            dat_file.close()
+    
+    from scikits.timeseries import tsfromtxt
+    
+    meta = read_header(dat_file)
+    
+    ## Create timeseries from dat_file
+    ## Note: dat_file is at the correct seek() position from read_header
+    timeseries = tsfromtxt(fname=dat_file,delimiter=',',datecols=0, freq='T'
+    ,dtype=float)
+
+    ## Create meta dictionary
+    meta_dict = parse_meta(meta)
+    
+    ## Mask bad values of all sensors at once, in place so the dates
+    ## stay attached
+    timeseries[filter_mask(timeseries, meta_dict['filters'].values())] = \
+        numpy.ma.masked
+    
+    return meta_dict, timeseries
+
+
+def parse_path(path, cache=True, lazy=False):
+    """Return parse_file() output for a WEC dat file given by its path.
+
+    Input: path of WEC data file
+    Optional: cache (boolean) reuse and write the binary cache of the file
+              lazy (boolean) return SensorEntry objects (see lazy_meta),
+              with the cache only the columns used are read from disk
     Output: Dictionary of timeseries with meta-data attached
     """
+    meta_dict, timeseries = load_data(path, cache)
+    return _meta_ts_dict(meta_dict, timeseries, lazy)
+
+
+def load_data(path, cache=True):
+    """Return parse_data() output for a WEC dat file given by its path.
+
+    Compressed files are read as described in open_dat().
+    The parsed values, mask, dates and meta data are kept in a binary
+    cache directory next to the file (path + '.cache') and reloaded with
+    memory mapping while the file keeps its size and modification time.
+    The values are stored column by column, so reading one sensor only
+    touches that sensor's part of the cache.
+
+    Input: path of WEC data file
+    Optional: cache (boolean) reuse and write the binary cache
+    Output: meta dictionary from parse_meta(),
+            2-D timeseries (time x sensors) with filter values masked
+    """
+    if cache:
+        cached = read_cache(path)
+        if cached is not None:
+            return cached
+    
+    meta_dict, timeseries = parse_data(path)
+    
+    if cache:
+        try:
+            write_cache(path, meta_dict, timeseries)
+        except (IOError, OSError):
+            ## A read only archive is parsed every time
+            pass
+    return meta_dict, timeseries
+
+
+def ingest(paths, processes=None, cache=True):
+    """Parse many WEC dat files over a process pool and join their data.
+
+    Rows of all files are put in date order. Where files overlap, the
+    file that comes later in path order wins. Gaps are filled with masked
+    rows on the time step of the data. All files must list the same
+    sensors.
+
+    Input: directory (all *.dat files in it), glob pattern or list of paths
+    Optional: processes (int) number of workers, all cores by default,
+              1 parses in this process
+              cache (boolean) use the binary caches (see load_data)
+    Output: Dictionary of joined timeseries with meta-data attached, as
+            parse_file() (general meta data is taken from the first file),
+            report: list with a dictionary per file of 'path', 'seconds'
+            (parse time), 'rows' and 'error' (None or message)
+    """
+    import scikits.timeseries as ts
+    
+    tasks = [(path, cache) for path in find_files(paths)]
+    results = _pool_map(_ingest_file, tasks, processes, chunksize=1)
+    
+    ## Only join files with the sensor layout of the first parsed file
+    parsed = []
+    for result in results:
+        if result['error'] is None:
+            if parsed and result['sensors'] != parsed[0]['sensors']:
+                result['error'] = ("Sensors differ from %s" %
+                                   parsed[0]['path'])
+            else:
+                parsed.append(result)
+    report = [dict((key, result[key]) for key in
+                   ('path', 'seconds', 'rows', 'error'))
+              for result in results]
+    if not parsed:
+        raise ValueError("No file could be parsed: %s" % report)
+    
+    ## Put all rows in date order, keeping the last of equal dates
+    dates = numpy.concatenate([result['dates'] for result in parsed])
+    order = numpy.argsort(dates, kind='mergesort')
+    dates = dates[order]
+    keep = numpy.concatenate((dates[1:] != dates[:-1], [True]))
+    dates = dates[keep]
+    values = numpy.concatenate([result['values'] for result in parsed])
+    mask = numpy.concatenate([result['mask'] for result in parsed])
+    values, mask = values[order][keep], mask[order][keep]
+    
+    ## Add masked rows for the gaps on the time step grid
+    meta_dict = parsed[0]['meta']
+    full_dates = dates
+    if isinstance(meta_dict['time_step'], int) and len(dates):
+        step = max(1, meta_dict['time_step'] // 60)
+        full_dates = numpy.union1d(numpy.arange(dates[0], dates[-1] + 1,
+                                                step), dates)
+    rows = numpy.searchsorted(full_dates, dates)
+    full_values = numpy.zeros((len(full_dates), values.shape[1]))
+    full_mask = numpy.ones(full_values.shape, dtype=bool)
+    full_values[rows], full_mask[rows] = values, mask
+    
+    timeseries = ts.time_series(numpy.ma.array(full_values, mask=full_mask),
+                                dates=ts.date_array(full_dates, freq='T'))
+    return _meta_ts_dict(meta_dict, timeseries), report
+
+
+def find_files(paths):
+    """Return the sorted list of dat files named by paths.
+
+    Input: directory (all dat files in it, see DAT_PATTERNS), glob
+           pattern or list of paths
+    Output: sorted list of paths
+    """
+    if isinstance(paths, str):
+        if os.path.isdir(paths):
+            return sorted(path for pattern in DAT_PATTERNS
+                          for path in glob.glob(os.path.join(paths, pattern)))
+        paths = glob.glob(paths)
+    return sorted(paths)
+
+
+def open_dat(path, background=True):
+    """Open a WEC dat file for reading, decompressing it if needed.
+
+    gzip, bz2 and xz files are recognised by their first bytes and
+    decompressed while they are read, without a temporary file.
+
+    Input: path of a (compressed) WEC data file
+    Optional: background (boolean) decompress on a separate thread, so
+              decompression overlaps parsing
+    Output: file object opened for reading text
+    """
+    raw_file = open(path, 'rb')
+    try:
+        magic = raw_file.read(6)
+    finally:
+        raw_file.close()
+    
+    for signature, module_name, class_name in COMPRESSIONS:
+        if magic.startswith(signature):
+            break
+    else:
+        return open(path)
+    
+    try:
+        module = __import__(module_name)
+    except ImportError:
+        raise ValueError("Reading %s needs the %s module" % (path,
+                                                             module_name))
+    compressed_file = getattr(module, class_name)(path, 'rb')
+    if background:
+        compressed_file = io.BufferedReader(
+            BackgroundReader(compressed_file), BackgroundReader.block_size)
+    return io.TextIOWrapper(compressed_file)
+
+
+class BackgroundReader(io.RawIOBase):
+    """
+    Binary stream reading another file on a separate thread.
+
+    The thread reads blocks of the file ahead into a bounded queue, so a
+    decompressing file works while the caller parses earlier blocks.
+    Errors of the thread are raised by the next read.
+    """
+    ## Bytes per block and number of blocks read ahead
+    block_size = 1 << 18
+    max_blocks = 8
+    
+    def __init__(self, source):
+        io.RawIOBase.__init__(self)
+        self._source = source
+        self._queue = queue.Queue(self.max_blocks)
+        self._stopped = threading.Event()
+        self._block = memoryview(b'')
+        self._error = None
+        self._end = False
+        self._thread = threading.Thread(target=self._read_ahead)
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def _read_ahead(self):
+        try:
+            block = True
+            while block and not self._stopped.is_set():
+                block = self._source.read(self.block_size)
+                self._put(block)
+        except Exception as error:
+            self._error = error
+            self._put(b'')
+    
+    def _put(self, block):
+        ## Give up when the reader is closed while the queue is full
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(block, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        if not len(self._block):
+            if self._end:
+                return 0
+            block = self._queue.get()
+            if not block:
+                self._end = True
+                if self._error is not None:
+                    raise IOError("Reading failed: %s" % self._error)
+                return 0
+            self._block = memoryview(block)
+        size = min(len(buffer), len(self._block))
+        buffer[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+    
+    def close(self):
+        if not self.closed:
+            self._stopped.set()
+            self._thread.join()
+            self._source.close()
+        io.RawIOBase.close(self)
+
+
+def _ingest_file(task):
+    """Parse one file for ingest(), catching and reporting errors."""
+    path, cache = task
+    result = {'path': path, 'seconds': 0., 'rows': 0, 'error': None}
+    start = time.time()
+    try:
+        meta_dict, timeseries = load_data(path, cache)
+        result['meta'] = meta_dict
+        result['sensors'] = [meta_dict['sensors'][number].get('name')
+                             for number in sorted(meta_dict['sensors'])]
+        result['dates'] = numpy.asarray(timeseries.dates.tovalue())
+        result['values'] = numpy.array(numpy.ma.getdata(timeseries))
+        result['mask'] = numpy.array(numpy.ma.getmaskarray(timeseries))
+        result['rows'] = len(timeseries)
+    except Exception as error:
+        result['error'] = "%s: %s" % (error.__class__.__name__, error)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def cache_key(path):
+    """Absolute path, size and modification time identifying a file."""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime
+
+
+def write_cache(path, meta_dict, timeseries, key=None):
+    """Write parse_data() output of the file at path to its binary cache.
+
+    Input: path of WEC data file, meta_dict, 2-D timeseries
+    Optional: key (tuple) of the parsed part of the file, cache_key(path)
+              by default
+    Output: path of the cache directory
+    """
+    if key is None:
+        key = cache_key(path)
+    
+    cache_dir = path + CACHE_SUFFIX
+    if not os.path.isdir(cache_dir):
+        os.mkdir(cache_dir)
+    
+    ## The meta file marks a complete cache, remove it while writing
+    meta_path = os.path.join(cache_dir, 'meta.pickle')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    
+    ## Column major arrays keep each sensor contiguous on disk
+    numpy.save(os.path.join(cache_dir, 'values.npy'),
+               numpy.asfortranarray(numpy.ma.getdata(timeseries)))
+    numpy.save(os.path.join(cache_dir, 'mask.npy'),
+               numpy.asfortranarray(numpy.ma.getmaskarray(timeseries)))
+    numpy.save(os.path.join(cache_dir, 'dates.npy'),
+               numpy.asarray(timeseries.dates.tovalue()))
     
+    meta_file = open(meta_path, 'wb')
+    try:
+        pickle.dump({'key': key, 'meta': meta_dict,
+                     'freq': timeseries.freqstr}, meta_file, 2)
+    finally:
+        meta_file.close()
+    return cache_dir
+
+
+def read_cache(path, check=True):
+    """Reload parse_data() output of the file at path from its binary cache.
+
+    Input: path of WEC data file
+    Optional: check (boolean) ignore the cache if the file changed since,
+              without checking the key is added to the output
+    Output: (meta_dict, 2-D timeseries) backed by memory mapped arrays,
+            or None if there is no cache or the file changed since
+    """
+    import scikits.timeseries as ts
+    
+    cache_dir = path + CACHE_SUFFIX
+    meta_path = os.path.join(cache_dir, 'meta.pickle')
+    if not os.path.exists(meta_path):
+        return None
+    meta_file = open(meta_path, 'rb')
+    try:
+        cached = pickle.load(meta_file)
+    finally:
+        meta_file.close()
+    if check and cached['key'] != cache_key(path):
+        return None
+    
+    values = numpy.load(os.path.join(cache_dir, 'values.npy'), mmap_mode='r')
+    mask = numpy.load(os.path.join(cache_dir, 'mask.npy'), mmap_mode='r')
+    dates = numpy.load(os.path.join(cache_dir, 'dates.npy'))
+    timeseries = ts.time_series(numpy.ma.array(values, mask=mask, copy=False),
+                                dates=ts.date_array(dates,
+                                                    freq=cached['freq']))
+    if not check:
+        return cached['meta'], timeseries, cached['key']
+    return cached['meta'], timeseries
+
+
+class TailReader(object):
+    """
+    Follow a WEC dat file that a logger keeps appending to.
+
+    Each update() parses only the complete lines written after the byte
+    offset reached before, appends their rows to the in-memory series and
+    folds them into running statistics of each sensor. Rows not later
+    than the last date read are skipped. If the file becomes shorter it
+    is read again from the start. Only uncompressed files can be followed.
+
+    With cache=True the reader starts from the binary cache of the file
+    (see load_data) if it covers a part of the current file. The cache
+    stores each sensor contiguously, so new rows cannot be appended to it
+    and every write is a full rewrite. New rows are therefore written at
+    most every cache_interval seconds, and by save(), which should be
+    called before the reader is dropped.
+    """
+    def __init__(self, path, cache=False, cache_interval=3600.):
+        self.path = path
+        self.cache = cache
+        self.cache_interval = cache_interval
+        self._reset()
+    
+    def _reset(self):
+        self._saved_rows = 0
+        self._saved_time = time.time()
+        self.offset = 0
+        self.last_date = None
+        self.meta_dict = None
+        self.statistics = []
+        self._rows = 0
+        self._dates = numpy.zeros(0, dtype=int)
+        self._values = numpy.zeros((0, 0))
+        self._mask = numpy.zeros((0, 0), dtype=bool)
+    
+    def update(self):
+        """
+        Read the lines appended since the last update.
+        Output: number of rows added to the series
+        """
+        if os.path.getsize(self.path) < self.offset:
+            self._reset()
+        if self.meta_dict is None and not self._start():
+            return 0
+        
+        ## Only read up to the last complete line
+        dat_file = open(self.path, 'rb')
+        try:
+            dat_file.seek(self.offset)
+            text = dat_file.read()
+        finally:
+            dat_file.close()
+        text = text[:text.rfind(b'\n') + 1]
+        if not text:
+            return 0
+        self.offset += len(text)
+        
+        lines = [line for line in text.decode('latin-1').splitlines()
+                 if line.strip()]
+        if not lines:
+            return 0
+        dates, values = parse_lines(lines,
+                                    list(self.meta_dict['filters'].values()))
+        dates = numpy.asarray(dates.tovalue())
+        if self.last_date is not None:
+            new = dates > self.last_date
+            dates, values = dates[new], values[new]
+        if not len(dates):
+            return 0
+        
+        self._append(dates, values)
+        if time.time() - self._saved_time >= self.cache_interval:
+            self.save()
+        return len(dates)
+    
+    def save(self):
+        """Write the rows read so far to the cache, if cache=True."""
+        if not self.cache or self._rows == self._saved_rows:
+            return
+        try:
+            stat = os.stat(self.path)
+            write_cache(self.path, self.meta_dict, self.timeseries,
+                        (os.path.abspath(self.path), self.offset,
+                         stat.st_mtime))
+        except (IOError, OSError):
+            return
+        self._saved_rows = self._rows
+        self._saved_time = time.time()
+    
+    def _start(self):
+        """Read the header or the cache, return False if still incomplete."""
+        if self.cache:
+            cached = read_cache(self.path, check=False)
+            if cached is not None:
+                meta_dict, timeseries, key = cached
+                if (key[0] == os.path.abspath(self.path) and
+                    key[1] <= os.path.getsize(self.path)):
+                    self.meta_dict, self.offset = meta_dict, key[1]
+                    self._append(numpy.asarray(timeseries.dates.tovalue()),
+                                 timeseries)
+                    self._saved_rows = self._rows
+                    return True
+        
+        ## Read the header as read_header() does, line by line, up to two
+        ## lines after '***', all of which must be complete
+        meta = []
+        dat_file = open(self.path, 'rb')
+        try:
+            while not meta or '***' not in meta[-1]:
+                line = dat_file.readline()
+                if not line.endswith(b'\n'):
+                    return False
+                meta.append(line.decode('latin-1').strip())
+            for skipped in range(2):
+                if not dat_file.readline().endswith(b'\n'):
+                    return False
+            self.offset = dat_file.tell()
+        finally:
+            dat_file.close()
+        self.meta_dict = parse_meta(meta)
+        return True
+    
+    def _append(self, dates, values):
+        """Add rows to the series, doubling the storage when it is full."""
+        if self._rows and values.shape[1] != self._values.shape[1]:
+            raise ValueError("New rows of %s have %d sensors instead of %d"
+                             % (self.path, values.shape[1],
+                                self._values.shape[1]))
+        rows = self._rows + len(dates)
+        if rows > len(self._dates) or not self._values.size:
+            capacity = max(rows, 2 * len(self._dates), 1024)
+            shape = (capacity, values.shape[1])
+            self._dates = numpy.resize(self._dates, capacity)
+            old_values, old_mask = self._values, self._mask
+            self._values = numpy.zeros(shape)
+            self._mask = numpy.ones(shape, dtype=bool)
+            if self._rows:
+                self._values[:self._rows] = old_values[:self._rows]
+                self._mask[:self._rows] = old_mask[:self._rows]
+        
+        self._dates[self._rows:rows] = dates
+        self._values[self._rows:rows] = numpy.ma.getdata(values)
+        self._mask[self._rows:rows] = numpy.ma.getmaskarray(values)
+        self._rows = rows
+        self.last_date = dates[-1]
+        
+        if not self.statistics:
+            self.statistics = [StatisticsAccumulator()
+                               for index in range(values.shape[1])]
+        for index, accumulator in enumerate(self.statistics):
+            accumulator.add(values[:, index])
+    
+    @property
+    def timeseries(self):
+        """2-D timeseries (time x sensors) of all rows read so far."""
+        import scikits.timeseries as ts
+        
+        return ts.time_series(numpy.ma.array(self._values[:self._rows],
+                                             mask=self._mask[:self._rows]),
+                              dates=ts.date_array(self._dates[:self._rows],
+                                                  freq='T'))
+    
+    def get_statistics(self):
+        """
+        Running statistics of each sensor.
+        Output: Dictionary of get_statistics() dictionaries keyed by
+                sensor number
+        """
+        return dict((index + 1, accumulator.get_statistics())
+                    for index, accumulator in enumerate(self.statistics))
+    
+    def meta_ts_dict(self, lazy=False):
+        """Return the rows read so far in the format of parse_file()."""
+        return _meta_ts_dict(dict(self.meta_dict), self.timeseries, lazy)
+
+
+def filter_mask(values, filters):
+    """Return a boolean array, True where values equal any filter value.
+
+    Input: (masked) array of values, filter values (e.g. -999, -991)
+    Output: boolean array shaped like values, from one membership test
+    """
+    values = numpy.ma.getdata(values)
+    return numpy.in1d(values.ravel(), list(filters)).reshape(values.shape)
+
+
+def data_recovery(timeseries):
+    """Return the number and fraction of valid values of each sensor.
+
+    Input: 2-D timeseries (time x sensors) with bad values masked
+    Output: valid_counts (int array), recovery_rates (float array, 0-1)
+    """
+    valid_counts = (~numpy.ma.getmaskarray(timeseries)).sum(axis=0)
+    return valid_counts, valid_counts / float(len(timeseries))
+
+
+def read_header(dat_file):
+    """Read the meta lines of a WEC dat file up to its data section.
+
+    Input: opened WEC data file
+    Output: list of stripped meta lines, dat_file is left at the first
+            line of data
+    """
     meta = []
     trigger = False
     
     ## Append lines to meta until you reach the data.
     while not trigger:
-        line = dat_file.readline().strip()
+        line = dat_file.readline()
+        if not line:
+            raise ValueError("No data section ('***') found in file")
+        line = line.strip()
         meta.append(line)
         if '***' in line:
+            ## Skip column names and the blank line after them
             dat_file.readline()
             dat_file.readline()
             trigger = True
     
-    
-    
-    ## Create timeseries from dat_file
-    ## Note: dat_file is at the correct seek() position from previous
-    ## while loop
-    timeseries = tsfromtxt(fname=dat_file,delimiter=',',datecols=0, freq='T'
-    ,dtype=float)
+    return meta
 
-    ## Separate timeseries
-    ts_dict = separate_timeseries(timeseries)
 
-    ## Create meta dictionary
-    meta_dict = parse_meta(meta)
+def read_chunks(dat_file, chunk_size=10000):
+    """Parse the header of a WEC dat file and stream its data in chunks.
+
+    Input: opened WEC data file, or path of a (compressed) WEC data file
+           which is closed after the last chunk
+    Optional: chunk_size (int) number of rows per chunk
+    Output: meta dictionary from parse_meta(),
+            generator of (dates, values) chunks, where dates is a
+            DateArray at minute frequency and values a 2-D masked array
+            (time x sensors) with filter values masked
+    """
+    opened = isinstance(dat_file, str)
+    if opened:
+        dat_file = open_dat(dat_file)
+    try:
+        meta_dict = parse_meta(read_header(dat_file))
+    except Exception:
+        if opened:
+            dat_file.close()
+        raise
+    filters = list(meta_dict['filters'].values())
     
-    ## Mask bad values
-    for index in ts_dict.iterkeys():
-        for value in meta_dict['filters'].itervalues():
-            ts_dict[index] = numpy.ma.masked_values(ts_dict[index], value)
+    def chunks():
+        try:
+            lines = []
+            for line in dat_file:
+                if line.strip():
+                    lines.append(line)
+                if len(lines) == chunk_size:
+                    yield parse_lines(lines, filters)
+                    lines = []
+            if lines:
+                yield parse_lines(lines, filters)
+        finally:
+            if opened:
+                dat_file.close()
     
+    return meta_dict, chunks()
 
+
+def parse_lines(lines, filters=()):
+    """Parse data lines of a WEC dat file into dates and values.
+
+    Input: list of 'YYYY-MM-DD HH:MM,value,value,...' lines
+    Optional: filters (list of filter values to mask)
+    Output: dates (DateArray at minute frequency),
+            values (2-D masked array, time x sensors), empty fields and
+            filter values are masked
+    """
+    import scikits.timeseries as ts
     
-    ## Assign meta data to ts data
-    meta_ts_dict = assign_meta(ts_dict, meta_dict)
+    fields = numpy.array([line.strip().split(',') for line in lines])
+    if fields.ndim != 2:
+        raise ValueError("Data lines have different numbers of fields")
     
-    return meta_ts_dict
+    dates = ts.date_array([parse_date(text) for text in fields[:, 0]],
+                          freq='T')
     
+    ## Empty fields are missing values
+    missing = fields[:, 1:] == ''
+    values = numpy.where(missing, 'nan', fields[:, 1:]).astype(float)
     
+    ## Mask bad values
+    missing |= filter_mask(values, filters)
+    
+    return dates, numpy.ma.array(values, mask=missing)
+
+
+def parse_date(text):
+    """Convert a 'YYYY-MM-DD HH:MM[:SS]' string to a datetime."""
+    text = text.strip()
+    if text.count(':') == 2:
+        return datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
+    return datetime.strptime(text, '%Y-%m-%d %H:%M')
     
 
 def parse_meta(meta_array):
@@ -242,3 +917,104 @@ def assign_meta(ts_dict, meta_dict):
             meta_ts_dict[key][index] = value
     
     return meta_ts_dict
+
+
+def lazy_meta(meta_dict, timeseries):
+    """
+    Lazy version of assign_meta() for a 2-D timeseries.
+    Input: meta_dict from parse_meta(), 2-D timeseries from parse_data()
+    Output: Dictionary of SensorEntry objects keyed by sensor number,
+            all sharing one copy of the general meta information
+    """
+    general_meta = dict(meta_dict)
+    sensors = general_meta.pop('sensors')
+    
+    meta_ts_dict = {}
+    for index in range(timeseries.shape[1]):
+        sensor_number = index + 1
+        column = _Column(timeseries, index)
+        meta_ts_dict[sensor_number] = SensorEntry(
+            general_meta, sensors.get(sensor_number, {}),
+            {'timeseries': column.timeseries,
+             'valid_count': column.valid_count,
+             'data_recovery': column.data_recovery})
+    return meta_ts_dict
+
+
+class _Column(object):
+    """Loaders for one column of a 2-D timeseries."""
+    def __init__(self, timeseries, index):
+        self.parent = timeseries
+        self.index = index
+    
+    def timeseries(self):
+        return self.parent[:, self.index]
+    
+    def valid_count(self):
+        return (~numpy.ma.getmaskarray(self.parent)[:, self.index]).sum()
+    
+    def data_recovery(self):
+        return self.valid_count() / float(len(self.parent))
+
+
+class SensorEntry(MutableMapping):
+    """
+    Meta data and timeseries of one sensor, as a dictionary.
+
+    Sensor specific meta data is held by the entry, general meta data is
+    looked up in a dictionary shared by all sensors of a file. Lazy items
+    such as 'timeseries' are computed on first access and then kept.
+    Values set on an entry only change that entry.
+    """
+    def __init__(self, general_meta, sensor_meta, lazy_items):
+        self._general = general_meta
+        self._own = dict(sensor_meta)
+        self._lazy = dict(lazy_items)
+        self._removed = set()
+    
+    def __getitem__(self, key):
+        if key in self._removed:
+            raise KeyError(key)
+        if key not in self._own and key in self._lazy:
+            self._own[key] = self._lazy.pop(key)()
+        if key in self._own:
+            return self._own[key]
+        return self._general[key]
+    
+    def __setitem__(self, key, value):
+        self._removed.discard(key)
+        self._lazy.pop(key, None)
+        self._own[key] = value
+    
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._own.pop(key, None)
+        self._lazy.pop(key, None)
+        self._removed.add(key)
+    
+    def __contains__(self, key):
+        return key not in self._removed and (key in self._own or
+                                             key in self._lazy or
+                                             key in self._general)
+    
+    def __iter__(self):
+        keys = set()
+        for source in (self._own, self._lazy, self._general):
+            ## Reading a lazy item while iterating moves it to _own
+            for key in list(source):
+                if key not in keys and key not in self._removed:
+                    keys.add(key)
+                    yield key
+    
+    def __len__(self):
+        return len(list(iter(self)))
+    
+    def loaded(self, key):
+        """Return True if a lazy item has been computed (or never was lazy)."""
+        return key not in self._lazy
+    
+    def copy(self):
+        """Return a plain dictionary with all items loaded."""
+        return dict(self.items())
+
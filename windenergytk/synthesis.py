@@ -34,7 +34,11 @@
 ################################################################################
 
 import numpy as np
-import scikits.timeseries as ts
+
+from windenergytk.analysis import get_weibull_params, _pool_map
+
+## scikits.timeseries is only needed to wrap results, so it is imported
+## by the functions that return timeseries.
 
 def find_bin(some_number, min, bins, value_range):
     """Find the bin (index) that a number falls into."""
@@ -51,31 +55,98 @@ def find_bin(some_number, min, bins, value_range):
     bin -= 1
     return bin
 
+def find_bins(values, min, bins, value_range):
+    """Find the bins (indices) of an array of numbers, as find_bin does."""
+    ## round(x + 0.5) - 1 of find_bin is floor(x) for the positive values
+    ## of x found here, ties included
+    bin_index = np.floor((np.asarray(values) - min) *
+                         (bins / float(value_range)))
+    return np.clip(bin_index, 0, bins - 1).astype(int)
+
+def get_random_state(random_state=None):
+    """
+    Random number source for the synthesis functions.
+    Input: None for the global numpy.random state, a seed (int or sequence
+           of ints) or a numpy.random.RandomState
+    Output: object with the numpy.random sampling methods
+    """
+    if random_state is None:
+        return np.random
+    if isinstance(random_state, np.random.RandomState):
+        return random_state
+    return np.random.RandomState(random_state)
+
 def weighted_choice(cumu_prob_vector):
     """Returns random number (0 < x < 1) weighted by the probability vector."""
     return np.searchsorted(cumu_prob_vector, np.random.uniform())
 
-def gen_arma(mean, stdev, autocor1, npoints):
-    """Normally distributed timeseries using Autoregressive Moving Average."""
-    ## Generate normally distributed noise array
-    ## WHY: Why use sqrt(1-autocor1**2) for STDEV?
-    noise = np.random.normal(0, (1-autocor1**2)**.5, npoints)
-    
-    ## Create autoregressive list with noise
-    ar_list = [0]
-    for i in range(1, len(noise)):
-        ar_list.append(autocor1 * ar_list[i-1] + noise[i])
-    
-    ## Adjust ARMA to have specified mean and stdev
-    arma_array = []
-    for index in range(len(ar_list)):
-        arma_array.append(mean + stdev * ar_list[index])
+def gen_arma(mean, stdev, autocor1, npoints, ar_coefs=None, ma_coefs=(),
+             random_state=None):
+    """
+    Normally distributed timeseries using Autoregressive Moving Average.
+    Input: mean, stdev, autocor1 (lag one autocorrelation), npoints
+    Optional: ar_coefs, ma_coefs (see gen_arma_array), by default an
+              AR(1) process with coefficient autocor1
+              random_state (see get_random_state)
+    Output: timeseries of npoints at one minute frequency
+    """
+    import scikits.timeseries as ts
+    if ar_coefs is None:
+        ar_coefs = [autocor1]
+    arma_array = gen_arma_array(mean, stdev, npoints, ar_coefs, ma_coefs,
+                                random_state=random_state)[0]
     
     arma_ts = ts.time_series(data=arma_array, 
     start_date="01-01-2001",freq='T')
     
     return arma_ts
 
+def gen_arma_array(mean, stdev, npoints, ar_coefs, ma_coefs=(), nseries=1,
+                   random_state=None):
+    """
+    Independent ARMA realisations as rows of a 2-D array.
+
+    x[t] = sum(ar_coefs[i] * x[t-1-i]) + e[t] + sum(ma_coefs[j] * e[t-1-j])
+    is run as a linear filter over normally distributed noise e, scaled so
+    that x has unit variance, then x is shifted and scaled to mean, stdev.
+    Each realisation starts from zero.
+    Input: mean, stdev, npoints, ar_coefs (array-like)
+    Optional: ma_coefs (array-like), nseries (int),
+              random_state (see get_random_state)
+    Output: ndarray of nseries x npoints
+    """
+    from scipy.signal import lfilter
+    ## Filter polynomials: a for the autoregressive part, b for the noise
+    a = np.concatenate(([1.], -np.asarray(ar_coefs, dtype=float)))
+    b = np.concatenate(([1.], np.asarray(ma_coefs, dtype=float)))
+    if len(a) > 1 and np.any(abs(np.roots(a)) >= 1):
+        raise ValueError("ar_coefs do not give a stationary process")
+
+    ## Generate normally distributed noise array with the stdev that gives
+    ## the filtered process unit variance, for AR(1) this is sqrt(1-ar**2)
+    random_state = get_random_state(random_state)
+    noise = random_state.normal(0, _arma_noise_stdev(a, b), (nseries, npoints))
+    noise[:, 0] = 0
+    
+    ## Adjust ARMA to have specified mean and stdev
+    return mean + stdev * lfilter(b, a, noise, axis=1)
+
+def _arma_noise_stdev(a, b, nterms=10000):
+    """
+    Noise stdev that gives an ARMA filter output of unit variance.
+    Input: a, b (filter polynomials as used by gen_arma_array)
+    Optional: nterms (int) length of the impulse response that is summed
+    Output: stdev (float)
+    """
+    from scipy.signal import lfilter
+    if len(a) == 2 and len(b) == 1:
+        return (1 - a[1]**2)**.5
+    ## Output variance per unit noise variance is the sum of the squared
+    ## impulse response
+    impulse = np.zeros(nterms)
+    impulse[0] = 1.
+    return 1. / (lfilter(b, a, impulse)**2).sum()**.5
+
 
 def gen_markov_tpm(tseries, bins):
     """Generate a Markov transition probability matrix from a timeseries."""
@@ -84,33 +155,31 @@ def gen_markov_tpm(tseries, bins):
     min = tseries.min()
     value_range = max - min
     
-    ## Create empty NxN matrix
-    tpm = np.zeros((bins, bins), dtype=np.float32)
-    
-    ## Tally number of transitions from one bin to another, save in matrix.
-    for i in range(len(tseries)-1):
-        ## Find bins
-        source_bin = find_bin(tseries[i], min, bins, value_range)
-        destination_bin = find_bin(tseries[i+1], min, bins, value_range)
-        
-        ## Add count to transition matrix
-        ## Sources are rows, destinations are columns
-        tpm[source_bin][destination_bin] += 1
+    ## Find bins of all values at once, transitions into or out of masked
+    ## values are not counted
+    bin_index = find_bins(np.ma.getdata(tseries), min, bins, value_range)
+    valid = ~np.ma.getmaskarray(tseries)
     
-    ## Total counts for each source bin
-    totals = tpm.sum(axis=1)
+    return _transition_matrix(bin_index, valid[:-1] & valid[1:], bins)
+
+def _transition_matrix(bin_index, valid_pairs, bins):
+    """
+    Tally and normalize transitions between consecutive bin indices.
+    Input: bin_index (int array), valid_pairs (boolean array, one shorter
+           than bin_index), bins (int)
+    Output: tpm = ndarray of bins*bins probabilities
+    """
+    ## Number each (source, destination) pair, sources are rows and
+    ## destinations are columns, and count all pairs in one pass
+    pairs = bin_index[:-1] * bins + bin_index[1:]
+    tpm = np.bincount(pairs[valid_pairs], minlength=bins * bins)
+    tpm = tpm.reshape(bins, bins).astype(np.float32)
     
     ## If a row of bins is empty, add one count for even probability
-    for index in range(len(totals)):
-        if totals[index] == 0:
-            ## Makes every value in tpm[index] equal to 1
-            tpm[index] = 1
-            ## Don't forget to change the new sum
-            totals[index] = bins
+    tpm[tpm.sum(axis=1) == 0] = 1
     
-    ## Iterate over tpm and normalize values to probability
-    for (row, column), value in np.ndenumerate(tpm):
-        tpm[row][column] = float(value) / totals[row]
+    ## Normalize rows to probability
+    tpm /= tpm.sum(axis=1)[:, np.newaxis]
     
     return tpm
     
@@ -121,35 +190,86 @@ def gen_cumu_tpm(tpm):
     
     return cumu_tpm
     
-def gen_ts_from_tpm(tpm, bin_width, length, freq='T'):
+def gen_alias_tables(tpm):
+    """
+    Create alias tables for sampling every row of a tpm in constant time.
+    INPUT: tpm  = ndarray of n*n values
+    OUTPUT: probability = ndarray of n*n, chance of keeping the drawn column
+            alias = ndarray of n*n, column to take otherwise
+    """
+    tpm = np.asarray(tpm, dtype=float)
+    bins = tpm.shape[1]
+    probability = np.ones(tpm.shape)
+    alias = np.tile(np.arange(bins), (len(tpm), 1))
+    
+    ## Vose's method: pair each column below the mean probability with one
+    ## above it, which donates the remainder of the small column's slot
+    for row in range(len(tpm)):
+        scaled = tpm[row] * bins / tpm[row].sum()
+        small = [column for column in range(bins) if scaled[column] < 1]
+        large = [column for column in range(bins) if scaled[column] >= 1]
+        while small and large:
+            small_column = small.pop()
+            large_column = large.pop()
+            probability[row, small_column] = scaled[small_column]
+            alias[row, small_column] = large_column
+            scaled[large_column] += scaled[small_column] - 1
+            if scaled[large_column] < 1:
+                small.append(large_column)
+            else:
+                large.append(large_column)
+    
+    return probability, alias
+
+def gen_chains_from_tpm(tpm, bin_width, length, nchains=1, block_size=1024,
+                        random_state=None):
+    """
+    Create independent wind speed series from a tpm, all chains at once.
+    INPUT: tpm  = ndarray of n*n values
+           bin_width (float), length (int)
+    OPTIONAL: nchains (int), block_size (int) steps of random numbers
+              drawn at a time, random_state (see get_random_state)
+    OUTPUT: ndarray of nchains*length wind speeds
+    """
+    random_state = get_random_state(random_state)
+    probability, alias = gen_alias_tables(tpm)
+    bins = len(probability)
+    
+    ## Initial wind range starts near median
+    source_bin = np.empty(nchains, dtype=int)
+    source_bin[:] = int(bins / 2)
+    
+    ## Destination bins of every step (rows) and chain (columns)
+    destination_bins = np.empty((length, nchains), dtype=int)
+    
+    for start in range(0, length, block_size):
+        ## Draw random numbers for a block of steps at once, the integer
+        ## part picks a column and the fraction decides column or alias
+        picks = random_state.uniform(size=(min(block_size, length - start),
+                                        nchains)) * bins
+        for step in range(len(picks)):
+            column = np.minimum(picks[step].astype(int), bins - 1)
+            keep = (picks[step] - column) < probability[source_bin, column]
+            source_bin = np.where(keep, column, alias[source_bin, column])
+            destination_bins[start + step] = source_bin
+    
+    ## Create random wind speed within range of destination bin
+    wind_speeds = (destination_bins.T +
+                   random_state.uniform(size=(nchains, length))) * bin_width
+    
+    return wind_speeds
+
+def gen_ts_from_tpm(tpm, bin_width, length, freq='T', random_state=None):
     """
     Create timeseries using a Transisiton Probability Matrix
     INPUT: tpm  = ndarray of n*n values
            length (int)
+    OPTIONAL: random_state (see get_random_state)
     OUTPUT: tseries = timeseries of length
     """
-    ## Create cumulative matrix from tpm
-    cumu_tpm = gen_cumu_tpm(tpm)
-    
-    ## Initial wind range starts near median
-    source_bin = int(len(cumu_tpm) / 2)
-
-    ## Create empty array for wind speed data
-    tseries_data = []
-
-    ## Create wind speed data
-    for index in range(length):
-        ## Find wind range that random number falls into
-        destination_bin = weighted_choice(cumu_tpm[source_bin])
-        
-        ## Create random wind speed within range of destination bin
-        wind_speed = (destination_bin + np.random.uniform()) * bin_width
-        
-        ## Add wind speed to timeseries
-        tseries_data.append(wind_speed)
-        
-        ## Destination bin becomes source bin
-        source_bin = destination_bin
+    import scikits.timeseries as ts
+    tseries_data = gen_chains_from_tpm(tpm, bin_width, length,
+                                       random_state=random_state)[0]
     
     ## Create timeseries out of tseries_data and freq
     tseries = ts.time_series(data=tseries_data, 
@@ -157,34 +277,141 @@ def gen_ts_from_tpm(tpm, bin_width, length, freq='T'):
     
     return tseries
 
-def add_diurnal(tseries, sine_period, peak_mag):
+def gen_ensemble(generator, nrealisations, master_seed, args=(),
+                 kwargs=None, processes=None):
+    """
+    Reproducible realisations of a synthesis function over a process pool.
+
+    Realisation i draws from its own stream, seeded with
+    (master_seed, i), so the result does not depend on the number of
+    processes or on how realisations are spread over them.
+    INPUT: generator = gen_arma_array, gen_chains_from_tpm, gen_arma or
+                       gen_ts_from_tpm (any function with random_state
+                       that returns one series, nseries or nchains 1)
+           nrealisations (int), master_seed (int)
+    OPTIONAL: args (tuple), kwargs (dict) passed on to generator,
+              processes (int) number of workers, all cores by default,
+              1 runs in this process
+    OUTPUT: ndarray of nrealisations*length
+    """
+    tasks = [(generator, args, kwargs or {}, (master_seed, index))
+             for index in range(nrealisations)]
+    
+    return np.vstack(_pool_map(_ensemble_member, tasks, processes))
+
+def _ensemble_member(task):
+    """Run one realisation of gen_ensemble as a flat array."""
+    generator, args, kwargs, seed = task
+    kwargs = dict(kwargs, random_state=np.random.RandomState(seed))
+    realisation = np.asarray(generator(*args, **kwargs))
+    if realisation.ndim > 1 and realisation.shape[0] != 1:
+        raise ValueError("gen_ensemble needs one series per realisation, "
+                         "the generator returned %d" % realisation.shape[0])
+    return realisation.ravel()
+
+def add_diurnal(tseries, sine_period, peak_mag, phase=0., harmonics=()):
     """
     Scales a time series to a sine wave of peak_mag with sine_period.
-    Input: tseries, sine_period (float, hrs), peak_mag (float)
-    Output: scaled_data (array-like)
+    Input: tseries, sine_period (int, hrs), peak_mag (float)
+    Optional: phase (float, radians) added to the sine argument,
+              harmonics (list of (sine_period, peak_mag, phase) tuples)
+              further sine waves summed into the profile, e.g.
+              [(8766, .2, 0.)] for a seasonal cycle on top of a daily one
+    Output: new scaled timeseries, the input is left unchanged
     """
-    # Convert sine_period to same frequency as tseries
+    ## Time passed since the start, in steps of the tseries frequency
+    passed_time = np.asarray(tseries.dates.tovalue(), dtype=float) - \
+                  tseries.start_date.value
+    
+    sine_factor = np.zeros(len(passed_time))
+    for period, magnitude, shift in [(sine_period, peak_mag, phase)] + \
+                                    list(harmonics):
+        angular_freq = (2. * np.pi) / _period_steps(period, tseries.freq)
+        sine_factor += magnitude * np.sin(angular_freq * passed_time + shift)
+    
+    return tseries + tseries * sine_factor
+
+def _period_steps(sine_period, freq):
+    """Length of a period given in hours, in steps of frequency freq."""
+    import scikits.timeseries as ts
     # Create a time delta of magnitude sine_period
     # Convert that time delta into frequency units same as tseries
     zero_date = ts.now('H')
     second_date = zero_date + sine_period
     time_delta = ts.date_array([zero_date, second_date])
-    time_delta = time_delta.asfreq(tseries.freq)
-    sine_period = float(time_delta[1] - time_delta[0])
+    time_delta = time_delta.asfreq(freq)
+    return float(time_delta[1] - time_delta[0])
+
+def gen_pdf(desired_mean, desired_stdev, bin_width, nbins=None):
+    """
+    Weibull probability of each wind speed bin, the reverse of a histogram.
+    Input: desired_mean, desired_stdev, bin_width (float)
+    Optional: nbins (int), by default enough bins from zero to hold all but
+              1e-4 of the distribution
+    Output: bin_edges (ndarray of nbins+1),
+            probabilities (ndarray of nbins) summing to one
+    """
+    if desired_mean <= 0 or desired_stdev <= 0:
+        raise ValueError("desired_mean and desired_stdev must be positive")
+    c, k = get_weibull_params(desired_mean, desired_stdev)
+    if nbins is None:
+        nbins = int(np.ceil(c * (-np.log(1e-4))**(1. / k) / bin_width))
     
-    angular_freq = (2. * np.pi) / sine_period
+    ## Weibull cumulative distribution at the bin edges, Manwell chapter 2
+    bin_edges = np.arange(nbins + 1) * float(bin_width)
+    cdf = 1 - np.exp(-(bin_edges / c)**k)
     
-    for i in range(len(tseries)-1):
-        passed_time = float(tseries.dates[i]- tseries.start_date)
-        sine_factor = peak_mag * np.sin(angular_freq * passed_time)
-        tseries[i] = tseries[i] + tseries[i] * sine_factor
+    ## Probabilities within the bins, the tail is folded into all bins
+    probabilities = np.diff(cdf) / cdf[-1]
     
-    return tseries
+    return bin_edges, probabilities
 
-# Generate power density function (pdf) to create synthetic TPM from
-# mean, stdev, autocorr, npointsx
+def sample_pdf(bin_edges, probabilities, uniforms):
+    """
+    Map uniform numbers to values of a binned distribution.
+    The piecewise linear cumulative distribution of the bins is inverted
+    by interpolation, values are uniform within each bin.
+    Input: bin_edges (n+1), probabilities (n) or counts as from
+           analysis.get_histogram_data(), uniforms (array-like, 0 to 1)
+    Output: ndarray of values shaped like uniforms
+    """
+    cdf = np.concatenate(([0.], np.cumsum(probabilities, dtype=float)))
+    return np.interp(uniforms, cdf / cdf[-1], bin_edges)
+
+def gen_from_pdf(bin_edges, probabilities, autocor1, npoints, nseries=1,
+                 random_state=None):
+    """
+    Series with a binned distribution and lag one autocorrelation.
 
-# def gen_pdf(desired_mean, desired_stdev, bin_width):
-    ## TODO
-    return 0
-## Essentially this is the reverse of the histogram
+    A unit normal AR(1) series is mapped to uniform numbers by the normal
+    cumulative distribution and then to the target distribution by
+    sample_pdf. The autocorrelation of the result is close to autocor1,
+    slightly lower for skewed distributions.
+    Input: bin_edges, probabilities (see gen_pdf or sample_pdf),
+           autocor1 (float), npoints (int)
+    Optional: nseries (int), random_state (see get_random_state)
+    Output: ndarray of nseries x npoints
+    """
+    from scipy.special import ndtr
+    normal = gen_arma_array(0., 1., npoints, [autocor1], nseries=nseries,
+                            random_state=random_state)
+    return sample_pdf(bin_edges, probabilities, ndtr(normal))
+
+def gen_synthetic_tpm(desired_mean, desired_stdev, autocor1, bin_width,
+                      npoints=100000, random_state=None):
+    """
+    Markov transition probability matrix from summary statistics alone.
+    Input: desired_mean, desired_stdev, autocor1, bin_width (float)
+    Optional: npoints (int) length of the synthetic series the transitions
+              are counted on, random_state (see get_random_state)
+    Output: tpm for gen_ts_from_tpm() with the same bin_width, the first
+            bin starts at zero
+    """
+    bin_edges, probabilities = gen_pdf(desired_mean, desired_stdev,
+                                       bin_width)
+    wind_speeds = gen_from_pdf(bin_edges, probabilities, autocor1, npoints,
+                               random_state=random_state)[0]
+    bin_index = np.minimum((wind_speeds / bin_width).astype(int),
+                           len(probabilities) - 1)
+    return _transition_matrix(bin_index, np.ones(npoints - 1, dtype=bool),
+                              len(probabilities))